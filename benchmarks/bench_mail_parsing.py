@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import random
+import mailbox
+import argparse
+import tempfile
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.application import MIMEApplication
+from email.header import Header
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def synthetic_message(i, rnd):
+    msg = MIMEMultipart()
+    msg["Subject"] = Header(f"Обновлено {rnd.randint(1, 40)} шт. конфигураций, отчет {i}", "utf-8")
+    msg["From"] = "robot@example.ru"
+    lines = [f"Клиент {rnd.randint(1, 500)}: обновление {rnd.randint(1, 99)} установлено." for _ in range(rnd.randint(20, 80))]
+    if i % 7 == 0:
+        lines.append("Предупреждение: конфигурация требует ручной проверки.")
+    if i % 11 == 0:
+        lines.append("Ошибка при загрузке обновления.")
+    charset = "koi8-r" if i % 3 == 0 else "utf-8"
+    msg.attach(MIMEText("\n".join(lines), "plain", charset))
+    msg.attach(MIMEText("<html><body>" + "<p>отчет</p>" * 50 + "</body></html>", "html", "utf-8"))
+    if i % 5 == 0:
+        attachment = MIMEApplication(rnd.randbytes(4096), Name="log.bin")
+        attachment["Content-Disposition"] = 'attachment; filename="log.bin"'
+        msg.attach(attachment)
+    return msg
+
+
+def build_mbox(path, count, seed=1):
+    rnd = random.Random(seed)
+    box = mailbox.mbox(path)
+    box.lock()
+    try:
+        for i in range(count):
+            box.add(synthetic_message(i, rnd))
+        box.flush()
+    finally:
+        box.unlock()
+        box.close()
+
+
+def read_mbox(path):
+    box = mailbox.mbox(path)
+    try:
+        return [(str(i + 1).encode(), box.get_bytes(key)) for i, key in enumerate(box.keys())]
+    finally:
+        box.close()
+
+
+def parse_serial(messages):
+    return main.parse_email_chunk(messages)
+
+
+def parse_pooled(messages):
+    stage = main.MailParseStage(main.parse_email_chunk, len(messages))
+    if stage.pool is None:
+        raise SystemExit("Пул процессов не запущен: проверьте MAIL_PARSE_WORKERS и MAIL_PARSE_POOL_THRESHOLD.")
+    for item in messages:
+        stage.add(item)
+    return stage.finish()
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def run(count, workers, chunk_size, mbox_path=None):
+    main.MAIL_PARSE_WORKERS = workers
+    main.MAIL_PARSE_CHUNK_SIZE = chunk_size
+    main.MAIL_PARSE_POOL_THRESHOLD = 1
+    main.mail_classifier = main.MailClassifier(main.build_mail_rules(
+        [f"Конфигурация {i}" for i in range(200)],
+        [f"Клиент {i}" for i in range(500)]
+    ))
+
+    with tempfile.TemporaryDirectory() as folder:
+        if mbox_path is None:
+            mbox_path = os.path.join(folder, "synthetic.mbox")
+            build_mbox(mbox_path, count)
+        messages = read_mbox(mbox_path)
+
+    serial, serial_s = timed(parse_serial, messages)
+    pooled, pooled_s = timed(parse_pooled, messages)
+    if serial != pooled:
+        raise SystemExit("Результаты разбора в пуле процессов отличаются от последовательного!")
+
+    print(f"Писем: {len(messages)}, процессов: {workers}, размер куска: {chunk_size}")
+    print(f"{'последовательно':>16}: {serial_s:.2f} с")
+    print(f"{'пул процессов':>16}: {pooled_s:.2f} с")
+    print(f"Ускорение: {serial_s / pooled_s:.1f}x")
+    return serial_s, pooled_s
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора MIME-писем в пуле процессов")
+    parser.add_argument("--count", type=int, default=20000, help="сколько писем сгенерировать")
+    parser.add_argument("--workers", type=int, default=main.MAIL_PARSE_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=main.MAIL_PARSE_CHUNK_SIZE)
+    parser.add_argument("--mbox", help="готовый mbox-файл вместо синтетического")
+    args = parser.parse_args()
+    run(args.count, args.workers, args.chunk_size, args.mbox)
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import main
+
+
+def synthetic_releases(configs=200, seed=1):
+    rnd = np.random.default_rng(seed)
+    names = [f"Конфигурация {i}" for i in range(configs)]
+    return pd.DataFrame({
+        'Конфигурации': names,
+        'Версия': [f"3.0.{rnd.integers(1, 200)}.{rnd.integers(1, 50)}" for _ in names],
+        'Вид расчета': ['БУ (Бюджет)' if i % 2 else 'ХО (Хозрасчет)' for i in range(configs)]
+    })
+
+
+def synthetic_updates(df_releases, rows, seed=2):
+    rnd = np.random.default_rng(seed)
+    # 10% строк относятся к продуктам, которых нет в списке конфигураций
+    products = np.append(df_releases['Конфигурации'].to_numpy(), ["Неизвестный продукт"] * (len(df_releases) // 9))
+    chosen = rnd.choice(products, size=rows)
+    current = dict(zip(df_releases['Конфигурации'], df_releases['Версия']))
+    actual = rnd.random(rows) < 0.7
+    versions = [current.get(p, "1.0.0.1") if ok else "3.0.1.1" for p, ok in zip(chosen, actual)]
+    return pd.DataFrame({
+        'Клиент': [f"Клиент {i % 5000}" for i in range(rows)],
+        'Программный продукт': chosen,
+        'Новый': versions
+    })
+
+
+def legacy_classify(df_updates, releases_dict):
+    def check_version(row):
+        product = row['Программный продукт']
+        version = row['Новый']
+        if product in releases_dict:
+            return 'Да' if version == releases_dict[product] else 'Нет'
+        return None
+
+    df_updates['Актуальный'] = df_updates.apply(check_version, axis=1)
+    return df_updates.dropna(subset=['Актуальный'])[['Клиент', 'Программный продукт', 'Новый', 'Актуальный']]
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def run(sizes, legacy_limit, write_limit, output=None):
+    df_releases = synthetic_releases()
+    releases_dict = dict(zip(df_releases['Конфигурации'], df_releases['Версия']))
+    results = []
+
+    for rows in sizes:
+        df_updates = synthetic_updates(df_releases, rows)
+        result = {'rows': rows}
+
+        df_report, result['classify_s'] = timed(main.classify_updates, df_updates.copy(), releases_dict)
+        summary_df, result['summary_s'] = timed(main.build_summary, df_releases, df_report, releases_dict)
+
+        if rows <= legacy_limit:
+            legacy_report, result['legacy_classify_s'] = timed(legacy_classify, df_updates.copy(), releases_dict)
+            if not legacy_report.equals(df_report):
+                raise SystemExit(f"Результат классификации на {rows} строках отличается от прежнего!")
+
+        if rows <= write_limit:
+            with tempfile.TemporaryDirectory() as folder:
+                main.REPORT_FOLDER = folder + os.sep
+                # данные подменены в памяти, поэтому размер книги для выбора потокового режима не проверяется
+                main.REPORT_STREAMING_ROWS = None
+                main.load_data = lambda: (df_releases.copy(), df_updates.copy())
+                _, result['process_report_s'] = timed(main.process_report, '3')
+
+        results.append(result)
+        print("  ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in result.items()))
+
+    if output:
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({'timestamp': datetime.datetime.now().isoformat(), 'results': results}) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк формирования отчёта на синтетических данных")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-limit", type=int, default=100_000, help="до какого размера сравнивать с построчным apply")
+    parser.add_argument("--write-limit", type=int, default=100_000, help="до какого размера запускать process_report целиком")
+    parser.add_argument("--output", help="файл JSON Lines для накопления результатов")
+    args = parser.parse_args()
+    run(args.sizes, args.legacy_limit, args.write_limit, args.output)
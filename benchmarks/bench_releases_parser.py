@@ -0,0 +1,69 @@
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+import main
+
+
+def synthetic_releases_page(rows=600, seed=1):
+    rnd = random.Random(seed)
+    lines = [
+        "<html><head><title>1С:Обновление программ</title></head><body>",
+        "<div class='header'>" + "<a href='#'>меню</a>" * 200 + "</div>",
+        "<table class='customTable'><thead><tr><th>Продукт</th><th>Версия</th><th>Дата</th></tr></thead><tbody>",
+    ]
+    for i in range(rows):
+        versions = "".join(
+            f"<a href='/version_files?nick=P{i}&amp;ver=3.0.{rnd.randint(1, 150)}.{rnd.randint(1, 99)}'>3.0.{rnd.randint(1, 150)}.{rnd.randint(1, 99)}</a><br/>"
+            for _ in range(3)
+        )
+        lines.append(
+            f"<tr><td class='nameColumn'><a href='/project/P{i}'> Конфигурация {i} </a></td>"
+            f"<td class='versionColumn'>{versions}</td><td>01.0{i % 9 + 1}.2024</td></tr>"
+        )
+    lines.append("</tbody></table>")
+    lines.append("<div class='footer'>" + "<p>подвал</p>" * 2000 + "</div></body></html>")
+    return "\n".join(lines)
+
+
+def parse_with_beautifulsoup(page_source):
+    soup = BeautifulSoup(page_source, 'html.parser')
+    table_body = soup.find('tbody')
+    rows = []
+    for row in table_body.find_all('tr'):
+        cells = row.find_all('td')
+        if len(cells) >= 3:
+            rows.append((cells[0].get_text(strip=True), main.extract_first_version_from_html(cells[1])))
+    return rows
+
+
+def parse_with_stream(page_source):
+    return list(main.iter_release_rows(page_source))
+
+
+def run(page_source, number=20):
+    expected = parse_with_beautifulsoup(page_source)
+    actual = parse_with_stream(page_source)
+    if expected != actual:
+        raise SystemExit("Результаты парсеров не совпадают!")
+
+    results = {}
+    for name, func in (("BeautifulSoup", parse_with_beautifulsoup), ("iter_release_rows", parse_with_stream)):
+        seconds = min(timeit.repeat(lambda: func(page_source), number=number, repeat=3)) / number
+        results[name] = seconds
+        print(f"{name:>20}: {seconds * 1000:.2f} мс на страницу ({len(actual)} строк)")
+    print(f"Ускорение: {results['BeautifulSoup'] / results['iter_release_rows']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            page = f.read()
+    else:
+        page = synthetic_releases_page()
+    run(page)
@@ -0,0 +1,134 @@
+import os
+import re
+import sys
+import random
+import time
+import timeit
+from functools import cmp_to_key
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def legacy_compare_versions(current_version, new_version):
+    current_version = re.sub(r'[^0-9.]', '', current_version)
+    new_version = re.sub(r'[^0-9.]', '', new_version)
+    try:
+        current_parts = list(map(int, current_version.split('.')))
+        new_parts = list(map(int, new_version.split('.')))
+        max_length = max(len(current_parts), len(new_parts))
+        current_parts.extend([0] * (max_length - len(current_parts)))
+        new_parts.extend([0] * (max_length - len(current_parts)))
+        return new_parts > current_parts
+    except ValueError:
+        return False
+
+
+def reference_cmp(a, b):
+    a_parts = [int(p) for p in a.split('.')]
+    b_parts = [int(p) for p in b.split('.')]
+    length = max(len(a_parts), len(b_parts))
+    a_parts += [0] * (length - len(a_parts))
+    b_parts += [0] * (length - len(b_parts))
+    return (a_parts > b_parts) - (a_parts < b_parts)
+
+
+def random_version(rnd):
+    parts = [str(rnd.randint(0, 3)) for _ in range(rnd.randint(1, 5))]
+    return ".".join(parts)
+
+
+def check_properties(samples=20000, seed=3):
+    rnd = random.Random(seed)
+    versions = [random_version(rnd) for _ in range(2000)]
+
+    for _ in range(samples):
+        a, b, c = rnd.choice(versions), rnd.choice(versions), rnd.choice(versions)
+        va, vb, vc = main.parse_version(a), main.parse_version(b), main.parse_version(c)
+        expected = reference_cmp(a, b)
+        assert (va > vb) == (expected > 0), (a, b)
+        assert (va == vb) == (expected == 0), (a, b)
+        assert main.compare_versions(a, b) == (expected < 0), (a, b)
+        assert not (va < vb and vb < va), (a, b)
+        if va <= vb and vb <= vc:
+            assert va <= vc, (a, b, c)
+        assert main.parse_version(a) == main.parse_version(a + ".0"), a
+        assert main.parse_version(" v" + a + " ") == va, a
+
+    by_key = sorted(versions, key=main.parse_version)
+    by_reference = sorted(versions, key=cmp_to_key(reference_cmp))
+    assert [main.parse_version(v).key for v in by_key] == [main.parse_version(v).key for v in by_reference]
+
+    index = main.VersionIndex()
+    history = sorted(set(versions), key=cmp_to_key(reference_cmp))
+    for version in rnd.sample(history, len(history)):
+        index.add_release("P", version)
+    for version in rnd.sample(history, 200):
+        newer = {main.parse_version(v).key for v in history if reference_cmp(v, version) > 0}
+        assert index.releases_behind("P", version) == len(newer), version
+    print(f"Свойства упорядочивания проверены на {samples} случайных тройках версий.")
+
+
+def run(number=200000):
+    rnd = random.Random(5)
+    pairs = [(f"3.0.{rnd.randint(1, 160)}.{rnd.randint(1, 60)}", f"3.0.{rnd.randint(1, 160)}.{rnd.randint(1, 60)}") for _ in range(500)]
+    parsed = [(main.parse_version(a), main.parse_version(b)) for a, b in pairs]
+
+    def legacy():
+        for a, b in pairs:
+            legacy_compare_versions(a, b)
+
+    def cached():
+        for a, b in pairs:
+            main.compare_versions(a, b)
+
+    def precomputed():
+        for a, b in parsed:
+            b.key > a.key
+
+    repeat = max(1, number // len(pairs))
+    for name, func in (("legacy compare_versions", legacy), ("compare_versions (кэш)", cached), ("Version.key", precomputed)):
+        seconds = min(timeit.repeat(func, number=repeat, repeat=3)) / (repeat * len(pairs))
+        print(f"{name:>24}: {seconds * 1e9:.0f} нс на сравнение")
+
+
+def run_staleness(rows=100_000, products=600, releases=40, number=20):
+    rnd = random.Random(7)
+    index = main.VersionIndex()
+    staleness = main.StalenessIndex(index)
+    for p in range(products):
+        for _ in range(releases):
+            index.add_release(f"P{p}", f"3.0.{rnd.randint(1, 160)}.{rnd.randint(1, 60)}")
+    # большинство клиентов обновлены до одного из последних релизов, отстающих - около 5%
+    update_rows = []
+    for i in range(rows):
+        product = f"P{rnd.randrange(products)}"
+        if rnd.random() < 0.95:
+            version = ".".join(map(str, rnd.choice(index.releases[product][-3:])))
+        else:
+            version = f"3.0.{rnd.randint(1, 160)}.{rnd.randint(1, 60)}"
+        update_rows.append((f"Клиент {i}", product, version))
+    started = time.perf_counter()
+    staleness.sync(update_rows)
+    build_s = time.perf_counter() - started
+
+    def recompute():
+        return [row for row in update_rows if (index.releases_behind(row[1], row[2]) or 0) > 2]
+
+    expected = sorted((client, product, index.releases_behind(product, version)) for client, product, version in recompute())
+    assert sorted(staleness.behind(2)) == expected
+
+    started = time.perf_counter()
+    index.add_release("P0", "9.9.9.9")
+    release_s = time.perf_counter() - started
+    recompute_s = min(timeit.repeat(recompute, number=1, repeat=3))
+    lookup_s = min(timeit.repeat(lambda: staleness.behind(2), number=number, repeat=3)) / number
+    print(f"Индекс отставания на {rows} строках: построение {build_s:.2f} с, новый релиз {release_s * 1000:.1f} мс")
+    print(f"'отстают больше чем на 2': пересчет {recompute_s * 1000:.0f} мс, по индексу {lookup_s * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    check_properties()
+    run()
+    run_staleness()
@@ -0,0 +1,63 @@
+import time
+import threading
+
+from telegram.error import RetryAfter
+
+
+class FakeDocument:
+    def __init__(self, file_id, file_name=None):
+        self.file_id = file_id
+        self.file_name = file_name
+
+
+class FakeMessage:
+    def __init__(self, chat_id, text=None, document=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.document = document
+
+
+class FakeBot:
+    # Заменяет telegram.Bot в бенчмарках: запоминает отправленное и может имитировать
+    # задержку сети и ответы 429 (RetryAfter) на каждое n-е сообщение.
+    def __init__(self, latency=0.0, retry_after_every=0, retry_after=1):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.sent = []
+        self.documents = []
+        self.file_ids = {}
+        self.uploaded_bytes = 0
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        if self.latency:
+            time.sleep(self.latency)
+        if self.retry_after_every and calls % self.retry_after_every == 0:
+            raise RetryAfter(self.retry_after)
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._call()
+        with self.lock:
+            self.sent.append((chat_id, text))
+        return FakeMessage(chat_id, text=text)
+
+    def send_document(self, chat_id, document, filename=None, **kwargs):
+        self._call()
+        if isinstance(document, str):
+            # повторная отправка по file_id: файл не загружается
+            with self.lock:
+                filename = self.file_ids[document]
+                self.documents.append((chat_id, filename, None))
+            return FakeMessage(chat_id, document=FakeDocument(document, filename))
+        data = document.read() if hasattr(document, 'read') else document
+        with self.lock:
+            file_id = f"file-{len(self.file_ids) + 1}"
+            self.file_ids[file_id] = filename
+            self.uploaded_bytes += len(data)
+            self.documents.append((chat_id, filename, len(data)))
+        return FakeMessage(chat_id, document=FakeDocument(file_id, filename))
@@ -0,0 +1,88 @@
+import os
+import sys
+import glob
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import Workbook
+import main
+from bench_releases_parser import synthetic_releases_page
+from bench_mail_parsing import build_mbox
+
+# Фикстуры складываются в каталог и переиспользуются между запусками: книга на 1M строк
+# строится минуты. Записанные с живого стенда файлы кладутся в тот же каталог:
+#   releases_page.html - сохраненная страница релизов портала
+#   mail/*.mbox        - выгрузки почтового ящика
+#   otchet.xlsx        - рабочая книга
+
+
+def configure(**values):
+    # настройки main.py читаются в момент вызова, поэтому достаточно подменить глобальные переменные
+    for name, value in values.items():
+        if not hasattr(main, name):
+            raise AttributeError(f"в main.py нет настройки {name}")
+        setattr(main, name, value)
+
+
+def config_name(i):
+    return f"Конфигурация {i}"
+
+
+def releases_page(folder, rows):
+    recorded = os.path.join(folder, "releases_page.html")
+    if os.path.exists(recorded):
+        with open(recorded, encoding="utf-8") as f:
+            return f.read(), "recorded"
+    path = os.path.join(folder, f"releases_page_{rows}.html")
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(synthetic_releases_page(rows))
+    with open(path, encoding="utf-8") as f:
+        return f.read(), "synthetic"
+
+
+def build_source_workbook(path, configs, update_rows, seed=1):
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    releases = wb.create_sheet(main.SHEET_NAME)
+    releases.append(["Конфигурации", "Описание", "Версия", "Вид расчета"])
+    releases.append(["Конфигурации бюджетных учреждений", None, None, None])
+    for i in range(configs):
+        if i == configs // 2:
+            releases.append(["Платформа 1С", None, "8.3.24.1342", None])
+        calc_type = "БУ (Бюджет)" if i % 2 else "ХО (Хозрасчет)"
+        releases.append([config_name(i), "", f"3.0.{rnd.randint(1, 150)}.{rnd.randint(1, 99)}", calc_type])
+
+    updates = wb.create_sheet(main.UPDATES_SHEET_NAME)
+    updates.append(["Клиент", "Программный продукт", "Старый", "Новый"])
+    for i in range(update_rows):
+        product = config_name(rnd.randrange(configs)) if rnd.random() < 0.9 else "Неизвестный продукт"
+        new_version = f"3.0.{rnd.randint(1, 150)}.{rnd.randint(1, 99)}"
+        updates.append([f"Клиент {i % 5000}", product, "3.0.1.1", new_version])
+    wb.save(path)
+
+
+def source_workbook(folder, update_rows, configs=600):
+    recorded = os.path.join(folder, "otchet.xlsx")
+    if os.path.exists(recorded):
+        return recorded, "recorded"
+    path = os.path.join(folder, f"otchet_{configs}_{update_rows}.xlsx")
+    if not os.path.exists(path):
+        print(f"Строим книгу: {configs} конфигураций, {update_rows} строк обновлений...")
+        build_source_workbook(path, configs, update_rows)
+    return path, "synthetic"
+
+
+def mbox_files(folder, counts):
+    recorded = sorted(glob.glob(os.path.join(folder, "mail", "*.mbox")))
+    if recorded:
+        return [(path, os.path.basename(path)) for path in recorded]
+    files = []
+    for count in counts:
+        path = os.path.join(folder, f"synthetic_{count}.mbox")
+        if not os.path.exists(path):
+            build_mbox(path, count)
+        files.append((path, f"synthetic_{count}"))
+    return files
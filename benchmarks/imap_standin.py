@@ -0,0 +1,245 @@
+import re
+import socket
+import select
+import email
+import mailbox
+import threading
+import socketserver
+
+# Минимальный IMAP-сервер для локальных прогонов: держит письма в памяти и понимает
+# ровно те команды, которые отправляет бот (включая BODYSTRUCTURE, BODY.PEEK[...] и IDLE).
+
+HEADER_FIELDS_PATTERN = re.compile(r'BODY(?:\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]', re.IGNORECASE)
+SECTION_PATTERN = re.compile(r'BODY(?:\.PEEK)?\[([\d.]+)\]', re.IGNORECASE)
+HEADER_END_PATTERN = re.compile(rb'\r?\n\r?\n')
+
+
+def quote(value):
+    if value is None:
+        return 'NIL'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def quote_params(pairs):
+    if not pairs:
+        return 'NIL'
+    return '(' + ' '.join(f'{quote(key.upper())} {quote(value)}' for key, value in pairs) + ')'
+
+
+def raw_payload(part):
+    payload = part.get_payload()
+    return payload.encode('utf-8', errors='surrogateescape') if isinstance(payload, str) else b''
+
+
+def bodystructure(part):
+    if part.is_multipart():
+        children = ''.join(bodystructure(child) for child in part.get_payload())
+        boundary = [('boundary', part.get_boundary())] if part.get_boundary() else []
+        return f'({children} {quote(part.get_content_subtype().upper())} {quote_params(boundary)} NIL NIL)'
+
+    payload = raw_payload(part)
+    maintype, subtype = part.get_content_maintype(), part.get_content_subtype()
+    params = [(key, value) for key, value in (part.get_params() or [])[1:]]
+    encoding = (part.get('Content-Transfer-Encoding') or '7bit').upper()
+    fields = [quote(maintype.upper()), quote(subtype.upper()), quote_params(params), 'NIL', 'NIL', quote(encoding), str(len(payload))]
+    if maintype == 'text':
+        fields.append(str(payload.count(b'\n') + 1))
+    fields.append('NIL')
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        fields.append(f'({quote(disposition.upper())} {quote_params([("filename", filename)] if filename else [])})')
+    else:
+        fields.append('NIL')
+    fields.append('NIL')
+    return '(' + ' '.join(fields) + ')'
+
+
+def find_section(message, section):
+    part = message
+    for number in section.split('.'):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != '1':
+            return None
+    return part
+
+
+def header_fields(raw, names):
+    match = HEADER_END_PATTERN.search(raw)
+    header = raw[:match.start()] if match else raw
+    wanted = {name.upper() for name in names}
+    lines = []
+    keep = False
+    for line in re.split(rb'\r?\n', header):
+        if line[:1] in (b' ', b'\t'):
+            if keep:
+                lines.append(line)
+            continue
+        keep = line.split(b':', 1)[0].strip().upper().decode('ascii', errors='ignore') in wanted
+        if keep:
+            lines.append(line)
+    return b'\r\n'.join(lines) + b'\r\n\r\n'
+
+
+def parse_uid_set(value, last_uid):
+    uids = set()
+    for part in value.split(','):
+        if ':' in part:
+            start, end = part.split(':')
+            start = last_uid if start == '*' else int(start)
+            end = last_uid if end == '*' else int(end)
+            uids.update(range(min(start, end), max(start, end) + 1))
+        else:
+            uids.add(last_uid if part == '*' else int(part))
+    return sorted(uid for uid in uids if 1 <= uid <= last_uid)
+
+
+class ImapHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # иначе Nagle и отложенный ACK добавляют ~40 мс к каждой команде на localhost
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        standin = self.server.standin
+        self.write('* OK IMAP stand-in ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode('utf-8', errors='ignore').strip().split(' ', 2)
+            if len(parts) < 2:
+                continue
+            tag, command, args = parts[0], parts[1].upper(), parts[2] if len(parts) > 2 else ''
+            if command == 'CAPABILITY':
+                self.write(f"* CAPABILITY IMAP4rev1{' IDLE' if standin.idle else ''}\r\n{tag} OK CAPABILITY completed\r\n")
+            elif command in ('LOGIN', 'CLOSE', 'NOOP'):
+                if command == 'NOOP':
+                    self.report_exists()
+                self.write(f'{tag} OK {command} completed\r\n')
+            elif command in ('SELECT', 'EXAMINE'):
+                self.seen = standin.count()
+                self.write(f'* {self.seen} EXISTS\r\n* OK [UIDVALIDITY {standin.uidvalidity}] UIDs valid\r\n'
+                           f'* OK [UIDNEXT {self.seen + 1}] next UID\r\n{tag} OK [READ-WRITE] SELECT completed\r\n')
+            elif command == 'STATUS':
+                self.write(f'* STATUS {args.split(" ")[0]} (UIDVALIDITY {standin.uidvalidity})\r\n{tag} OK STATUS completed\r\n')
+            elif command == 'UID':
+                self.uid_command(tag, args)
+            elif command == 'IDLE' and standin.idle:
+                self.idle(tag)
+            elif command == 'LOGOUT':
+                self.write(f'* BYE logging out\r\n{tag} OK LOGOUT completed\r\n')
+                return
+            else:
+                self.write(f'{tag} BAD unsupported command\r\n')
+
+    def report_exists(self):
+        count = self.server.standin.count()
+        if count != getattr(self, 'seen', count):
+            self.write(f'* {count} EXISTS\r\n')
+        self.seen = count
+
+    def idle(self, tag):
+        self.write('+ idling\r\n')
+        while True:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                if not self.rfile.readline():
+                    return
+                break
+            self.report_exists()
+        self.write(f'{tag} OK IDLE terminated\r\n')
+
+    def uid_command(self, tag, args):
+        standin = self.server.standin
+        subcommand, _, rest = args.partition(' ')
+        last_uid = standin.count()
+        if subcommand.upper() == 'SEARCH':
+            match = re.search(r'UID (\S+)', rest, re.IGNORECASE)
+            uids = parse_uid_set(match.group(1), last_uid) if match else list(range(1, last_uid + 1))
+            self.write(f"* SEARCH {' '.join(map(str, uids))}\r\n{tag} OK SEARCH completed\r\n".replace('SEARCH \r\n', 'SEARCH\r\n'))
+        elif subcommand.upper() == 'FETCH':
+            uid_set, _, items = rest.partition(' ')
+            responses = [self.fetch_response(uid, items) for uid in parse_uid_set(uid_set, last_uid)]
+            self.write(b''.join(responses) + f'{tag} OK FETCH completed\r\n'.encode())
+        else:
+            self.write(f'{tag} BAD unsupported UID command\r\n')
+
+    def fetch_response(self, uid, items):
+        raw, message = self.server.standin.message(uid)
+        chunks = [f'* {uid} FETCH (UID {uid}'.encode()]
+        upper = items.upper()
+        if 'BODYSTRUCTURE' in upper:
+            chunks.append(b' BODYSTRUCTURE ' + bodystructure(message).encode('utf-8'))
+        literals = []
+        if re.search(r'\bRFC822\b(?!\.)', upper):
+            literals.append(('RFC822', raw))
+        fields = HEADER_FIELDS_PATTERN.search(items)
+        if fields:
+            literals.append((f'BODY[HEADER.FIELDS ({fields.group(1)})]', header_fields(raw, fields.group(1).split())))
+        for section in SECTION_PATTERN.findall(items):
+            part = find_section(message, section)
+            literals.append((f'BODY[{section}]', raw_payload(part) if part is not None else b''))
+        for name, literal in literals:
+            chunks.append(f' {name} {{{len(literal)}}}\r\n'.encode() + literal)
+        chunks.append(b')\r\n')
+        return b''.join(chunks)
+
+
+class ImapStandIn:
+    def __init__(self, messages=(), uidvalidity=1, idle=True, host='127.0.0.1'):
+        self.uidvalidity = uidvalidity
+        self.idle = idle
+        self.lock = threading.Lock()
+        self.messages = []
+        for raw in messages:
+            self.add(raw)
+        self.server = socketserver.ThreadingTCPServer((host, 0), ImapHandler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+        self.thread = None
+
+    @classmethod
+    def from_mbox(cls, path, **kwargs):
+        box = mailbox.mbox(path)
+        try:
+            messages = [box.get_bytes(key) for key in box.keys()]
+        finally:
+            box.close()
+        return cls(messages, **kwargs)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def add(self, raw):
+        with self.lock:
+            self.messages.append((raw, email.message_from_bytes(raw)))
+
+    def count(self):
+        with self.lock:
+            return len(self.messages)
+
+    def message(self, uid):
+        with self.lock:
+            return self.messages[uid - 1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='imap-standin')
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
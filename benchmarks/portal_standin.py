@@ -0,0 +1,210 @@
+import os
+import sys
+import html
+import secrets
+import threading
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная замена портала релизов и CAS-сервера login.1c.ru: портал без сессии
+# перенаправляет на форму входа со скрытыми полями, CAS после POST выдает тикет и
+# возвращает на портал, портал меняет тикет на cookie. Хосты разные (127.0.0.1 и
+# localhost), как у настоящих releases.1c.ru и login.1c.ru.
+
+SESSION_COOKIE = 'portal_session'
+
+
+def login_form(service, execution, error=None):
+    message = f'<div class="error">{html.escape(error)}</div>' if error else ''
+    action = '/login?' + urlencode({'service': service})
+    return (
+        '<html><body>' + message +
+        f'<form id="fm1" method="post" action="{html.escape(action)}">'
+        '<input id="username" name="username" type="text" value="">'
+        '<input id="password" name="password" type="password" value="">'
+        f'<input type="hidden" name="execution" value="{execution}">'
+        '<input type="hidden" name="_eventId" value="submit">'
+        '<input type="submit" value="Войти">'
+        '</form></body></html>'
+    )
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, status=200, headers=()):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def redirect(self, location, headers=()):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+
+class PortalHandler(StandInHandler):
+    def do_GET(self):
+        standin = self.server.standin
+        url = urlparse(self.path)
+        if url.path == '/ticket-callback':
+            ticket = parse_qs(url.query).get('ticket', [''])[0]
+            if not standin.redeem_ticket(ticket):
+                self.send_body('invalid ticket', status=403)
+                return
+            session = secrets.token_hex(8)
+            standin.sessions.add(session)
+            self.redirect('/releases', headers=[('Set-Cookie', f'{SESSION_COOKIE}={session}; Path=/; HttpOnly')])
+            return
+
+        cookies = dict(
+            part.strip().split('=', 1) for part in (self.headers.get('Cookie') or '').split(';') if '=' in part
+        )
+        if cookies.get(SESSION_COOKIE) not in standin.sessions:
+            self.redirect(f"{standin.login_url}?{urlencode({'service': standin.portal_url + '/ticket-callback'})}")
+            return
+        self.send_body(standin.page)
+
+
+class CasHandler(StandInHandler):
+    def do_GET(self):
+        standin = self.server.standin
+        service = parse_qs(urlparse(self.path).query).get('service', [standin.portal_url + '/ticket-callback'])[0]
+        self.send_body(login_form(service, standin.new_execution()))
+
+    def do_POST(self):
+        standin = self.server.standin
+        length = int(self.headers.get('Content-Length') or 0)
+        fields = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        service = parse_qs(urlparse(self.path).query).get('service', [''])[0]
+        if fields.get('_eventId') != 'submit' or not standin.use_execution(fields.get('execution')):
+            self.send_body(login_form(service, standin.new_execution(), "Форма устарела"), status=200)
+            return
+        if (fields.get('username'), fields.get('password')) != (standin.username, standin.password):
+            self.send_body(login_form(service, standin.new_execution(), "Неверный логин или пароль"), status=200)
+            return
+        standin.logins += 1
+        self.redirect(f"{service}?{urlencode({'ticket': standin.issue_ticket()})}")
+
+
+class PortalStandIn:
+    def __init__(self, page, username='user', password='secret'):
+        self.page = page
+        self.username = username
+        self.password = password
+        self.lock = threading.Lock()
+        self.executions = set()
+        self.tickets = set()
+        self.sessions = set()
+        self.logins = 0
+        self.portal = ThreadingHTTPServer(('127.0.0.1', 0), PortalHandler)
+        self.cas = ThreadingHTTPServer(('localhost', 0), CasHandler)
+        for server in (self.portal, self.cas):
+            server.daemon_threads = True
+            server.standin = self
+
+    @property
+    def portal_url(self):
+        return f"http://127.0.0.1:{self.portal.server_address[1]}"
+
+    @property
+    def login_url(self):
+        return f"http://localhost:{self.cas.server_address[1]}/login"
+
+    def new_execution(self):
+        with self.lock:
+            execution = secrets.token_hex(8)
+            self.executions.add(execution)
+            return execution
+
+    def use_execution(self, execution):
+        with self.lock:
+            if execution in self.executions:
+                self.executions.discard(execution)
+                return True
+            return False
+
+    def issue_ticket(self):
+        with self.lock:
+            ticket = f"ST-{secrets.token_hex(8)}"
+            self.tickets.add(ticket)
+            return ticket
+
+    def redeem_ticket(self, ticket):
+        with self.lock:
+            if ticket in self.tickets:
+                self.tickets.discard(ticket)
+                return True
+            return False
+
+    def expire_sessions(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def start(self):
+        for server in (self.portal, self.cas):
+            threading.Thread(target=server.serve_forever, daemon=True, name='portal-standin').start()
+        return self
+
+    def stop(self):
+        for server in (self.portal, self.cas):
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def check_http_login():
+    # проверка CAS-входа main.http_login без сети: успешный вход, повтор по cookie, истекшая сессия и неверный пароль
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+    import fixtures
+    from bench_releases_parser import synthetic_releases_page
+
+    with PortalStandIn(synthetic_releases_page(20)) as standin:
+        fixtures.configure(
+            FETCH_BACKEND='http',
+            DATA_URL=standin.portal_url + '/releases',
+            LOGIN_URL=standin.login_url,
+            USERNAME=standin.username,
+            PASSWORD=standin.password
+        )
+        main.http_session_instance = None
+        with main.http_session() as client:
+            main.open_releases_page_http(client)
+            assert client.page_source == standin.page and standin.logins == 1, "вход через CAS не выполнен"
+            main.open_releases_page_http(client)
+            assert standin.logins == 1, "сессия портала не переиспользована"
+            standin.expire_sessions()
+            main.open_releases_page_http(client)
+            assert standin.logins == 2, "истекшая сессия не обновлена"
+
+        main.http_session_instance = None
+        fixtures.configure(PASSWORD='wrong')
+        try:
+            with main.http_session() as client:
+                main.open_releases_page_http(client)
+        except Exception as e:
+            assert "авторизации" in str(e), e
+        else:
+            raise AssertionError("вход с неверным паролем не отклонен")
+        main.http_session_instance = None
+    print("CAS-вход через HTTP: OK")
+
+
+if __name__ == "__main__":
+    check_http_login()
@@ -0,0 +1,317 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tracemalloc
+import datetime
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import fixtures
+from fake_bot import FakeBot
+from imap_standin import ImapStandIn
+from portal_standin import PortalStandIn
+
+PROFILES = {
+    'quick': {
+        'releases': [200], 'excel': [1_000], 'mail': [200], 'report': [1_000], 'broadcast': [100], 'delivery': [10]
+    },
+    'default': {
+        'releases': [600, 3_000], 'excel': [1_000, 100_000], 'mail': [200, 2_000],
+        'report': [1_000, 10_000, 100_000], 'broadcast': [100, 1_000], 'delivery': [10, 100]
+    },
+    'full': {
+        'releases': [600, 3_000], 'excel': [1_000, 100_000, 1_000_000], 'mail': [200, 2_000, 20_000],
+        'report': [1_000, 10_000, 100_000, 1_000_000], 'broadcast': [100, 1_000, 10_000], 'delivery': [10, 100, 1_000]
+    }
+}
+
+
+class Suite:
+    def __init__(self, fixtures_dir, work_dir, repeat, verbose, memory=False):
+        self.fixtures_dir = fixtures_dir
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.verbose = verbose
+        self.memory = memory
+        self.results = []
+
+    def measure(self, stage, case, fixture, func, prepare=None):
+        timings = []
+        for _ in range(self.repeat):
+            if prepare:
+                prepare()
+            main.workbook_cache.clear()
+            main.metrics.reset()
+            output = io.StringIO()
+            with contextlib.redirect_stdout(sys.stdout if self.verbose else output):
+                started = time.perf_counter()
+                extra = func()
+                timings.append(time.perf_counter() - started)
+        stages, counters = main.metrics.snapshot()
+        peak = None
+        if self.memory:
+            # отдельный прогон: под tracemalloc код заметно медленнее, время из него не берется
+            if prepare:
+                prepare()
+            main.workbook_cache.clear()
+            with contextlib.redirect_stdout(sys.stdout if self.verbose else io.StringIO()):
+                tracemalloc.start()
+                try:
+                    func()
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+        result = {
+            'stage': stage,
+            'case': case,
+            'fixture': fixture,
+            'seconds': timings,
+            'best': min(timings),
+            'median': statistics.median(timings),
+            'breakdown': {name: {'sum': data['sum'], 'count': data['count']} for name, data in stages.items()},
+            'counters': counters,
+            'peak_bytes': peak
+        }
+        result.update(extra or {})
+        self.results.append(result)
+        breakdown = ", ".join(f"{name} {data['sum']:.3f}" for name, data in sorted(result['breakdown'].items()))
+        memory = f"  пик {peak / 2**20:.0f} МБ" if peak is not None else ""
+        print(f"{stage:>9} {case:<28} {result['best']:8.3f} с{memory}  {breakdown}")
+        return result
+
+    def work_path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def bench_releases(self, rows):
+        page, kind = fixtures.releases_page(self.fixtures_dir, rows)
+        source, _ = fixtures.source_workbook(self.fixtures_dir, 1_000, configs=rows)
+        workbook = self.work_path("releases.xlsx")
+        history = self.work_path("release_history.jsonl")
+
+        def prepare():
+            # каждый повтор видит релизы впервые: пустые история и индекс версий
+            shutil.copyfile(source, workbook)
+            if os.path.exists(history):
+                os.remove(history)
+            main.version_index.releases.clear()
+            main.release_history_loaded.clear()
+
+        with PortalStandIn(page) as standin:
+            fixtures.configure(
+                FETCH_BACKEND='http',
+                DATA_URL=standin.portal_url + '/releases',
+                LOGIN_URL=standin.login_url,
+                USERNAME=standin.username,
+                PASSWORD=standin.password,
+                DEEP_RELEASE_CHECK=False,
+                STORAGE_BACKEND='excel',
+                EXCEL_FILE_PATH=workbook,
+                RELEASE_HISTORY_FILE=history
+            )
+
+            def prepare_login():
+                # новая сессия requests: каждый повтор проходит CAS-вход заново
+                prepare()
+                main.http_session_instance = None
+
+            self.measure(
+                'releases', f"{rows} строк, вход", kind,
+                lambda: {'updated': len(main.check_updates()), 'logins': standin.logins},
+                prepare=prepare_login
+            )
+            self.measure(
+                'releases', f"{rows} строк", kind,
+                lambda: {'updated': len(main.check_updates())},
+                prepare=prepare
+            )
+
+    def bench_excel(self, update_rows):
+        source, kind = fixtures.source_workbook(self.fixtures_dir, update_rows)
+        workbook = self.work_path("excel.xlsx")
+        fixtures.configure(STORAGE_BACKEND='excel', EXCEL_FILE_PATH=workbook)
+
+        def load():
+            releases, _, _ = main.load_releases_from_excel()
+            return {'releases': len(releases)}
+
+        def update():
+            releases, _, _ = main.load_releases_from_excel()
+            for data in releases.values():
+                data['version'] = data['version'] + ".1"
+            main.update_releases_in_excel(releases)
+
+        self.measure('excel', f"load {update_rows} строк", kind, load, prepare=lambda: shutil.copyfile(source, workbook))
+        self.measure('excel', f"update {update_rows} строк", kind, update, prepare=lambda: shutil.copyfile(source, workbook))
+
+    def bench_mail(self, count):
+        workbook, _ = fixtures.source_workbook(self.fixtures_dir, 1_000)
+        for path, kind in fixtures.mbox_files(self.fixtures_dir, [count]):
+            with ImapStandIn.from_mbox(path) as standin:
+                state_file = self.work_path("mail_state.json")
+                log_file = self.work_path("mail_updates.jsonl")
+
+                def reset():
+                    for leftover in (state_file, log_file):
+                        if os.path.exists(leftover):
+                            os.remove(leftover)
+
+                for pipelined in (True, False):
+                    fixtures.configure(
+                        EMAIL_HOST=standin.address[0],
+                        EMAIL_PORT=standin.address[1],
+                        EMAIL_USE_SSL=False,
+                        MAIL_PIPELINED_FETCH=pipelined,
+                        MAIL_STATE_FILE=state_file,
+                        MAIL_LOG_FILE=log_file,
+                        STORAGE_BACKEND='excel',
+                        EXCEL_FILE_PATH=workbook
+                    )
+                    mode = "pipelined" if pipelined else "rfc822"
+                    self.measure(
+                        'mail', f"{mode} {standin.count()} писем", kind,
+                        lambda: {'parsed': len(main.check_email_updates())},
+                        prepare=reset
+                    )
+
+    def bench_report(self, update_rows):
+        workbook, kind = fixtures.source_workbook(self.fixtures_dir, update_rows)
+        report_folder = self.work_path("reports") + os.sep
+        os.makedirs(report_folder, exist_ok=True)
+        fixtures.configure(STORAGE_BACKEND='excel', EXCEL_FILE_PATH=workbook, REPORT_FOLDER=report_folder)
+        threshold = main.REPORT_STREAMING_ROWS
+        try:
+            for mode, streaming_rows in (("в памяти", None), ("потоком", 0)):
+                main.REPORT_STREAMING_ROWS = streaming_rows
+                self.measure('report', f"{mode} {update_rows} строк", kind, lambda: {'report_bytes': os.path.getsize(main.process_report('3'))})
+        finally:
+            main.REPORT_STREAMING_ROWS = threshold
+
+    def bench_broadcast(self, chats, latency):
+        text = "\n".join(f"Обновлено: {fixtures.config_name(i)} - 3.0.{i}.1" for i in range(400))
+        main.broadcast_limiter = main.RateLimiter(1_000_000)
+        main.chat_limiter = main.RateLimiter(1_000_000)
+        bot = FakeBot(latency=latency)
+        self.measure(
+            'broadcast', f"{chats} чатов", f"FakeBot {latency * 1000:.0f} мс",
+            lambda: {'delivered': main.broadcast(text, chat_ids=range(chats), bot=bot)}
+        )
+
+
+    def bench_delivery(self, chats, latency):
+        # отчет режется на части по искусственно низкому пределу, чтобы проверить деление и повторы по file_id
+        workbook, kind = fixtures.source_workbook(self.fixtures_dir, 10_000)
+        report_folder = self.work_path("delivery") + os.sep
+        os.makedirs(report_folder, exist_ok=True)
+        fixtures.configure(STORAGE_BACKEND='excel', EXCEL_FILE_PATH=workbook, REPORT_FOLDER=report_folder)
+        with contextlib.redirect_stdout(io.StringIO()):
+            report_path = main.process_report('3')
+        limit = main.TELEGRAM_DOCUMENT_LIMIT
+        main.TELEGRAM_DOCUMENT_LIMIT = max(64 * 1024, os.path.getsize(report_path) // 4)
+        file_ids = self.work_path("telegram_file_ids.json")
+        fixtures.configure(TELEGRAM_FILE_IDS_FILE=file_ids)
+        bot = FakeBot(latency=latency)
+
+        def prepare():
+            main.delivery_cache.clear()
+            if os.path.exists(file_ids):
+                os.remove(file_ids)
+            bot.uploaded_bytes = 0
+
+        def deliver():
+            parts = [main.deliver_report(bot, chat_id, report_path) for chat_id in range(chats)]
+            return {'parts': parts[0], 'uploaded_bytes': bot.uploaded_bytes}
+
+        try:
+            self.measure('delivery', f"{chats} чатов", kind, deliver, prepare=prepare)
+        finally:
+            main.TELEGRAM_DOCUMENT_LIMIT = limit
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(item['stage'], item['case']): item for item in baseline['results']}
+    regressions = []
+    print(f"\nСравнение с {baseline_path} ({baseline.get('version')}):")
+    for item in results:
+        old = previous.get((item['stage'], item['case']))
+        if not old:
+            continue
+        ratio = item['best'] / old['best'] if old['best'] else float('inf')
+        mark = "  <-- регрессия" if ratio > threshold else ""
+        print(f"{item['stage']:>9} {item['case']:<28} {old['best']:8.3f} -> {item['best']:8.3f} с  x{ratio:.2f}{mark}")
+        if ratio > threshold:
+            regressions.append(item)
+    return regressions
+
+
+def run(args):
+    sizes = PROFILES[args.profile]
+    fixtures_dir = args.fixtures_dir or os.path.join(tempfile.gettempdir(), "auto1c_bench_fixtures")
+    os.makedirs(fixtures_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as work_dir:
+        fixtures.configure(
+            RELEASE_HISTORY_FILE=os.path.join(work_dir, "release_history.jsonl"),
+            REPORT_CACHE_FILE=os.path.join(work_dir, "report_cache.json"),
+            METRICS_FILE=os.path.join(work_dir, "metrics.prom")
+        )
+        suite = Suite(fixtures_dir, work_dir, args.repeat, args.verbose, args.memory)
+        for stage in args.stages:
+            for size in sizes[stage]:
+                if stage in ('broadcast', 'delivery'):
+                    getattr(suite, f"bench_{stage}")(size, args.bot_latency)
+                else:
+                    getattr(suite, f"bench_{stage}")(size)
+
+    report = {
+        'version': git_version(),
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'profile': args.profile,
+        'repeat': args.repeat,
+        'results': suite.results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены: {args.output}")
+    regressions = compare(suite.results, args.compare, args.threshold) if args.compare else []
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк всех этапов бота на фикстурах")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="default")
+    parser.add_argument("--stages", nargs="+", choices=list(PROFILES['default']), default=list(PROFILES['default']))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fixtures-dir", help="каталог с фикстурами (записанные файлы используются вместо синтетических)")
+    parser.add_argument("--bot-latency", type=float, default=0.02, help="задержка FakeBot на одно сообщение, с")
+    parser.add_argument("--output", help="файл JSON с результатами")
+    parser.add_argument("--compare", help="файл JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.15, help="во сколько раз медленнее считать регрессией")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--memory", action="store_true", help="дополнительно замерить пик памяти (tracemalloc)")
+    parser.add_argument("--verbose", action="store_true", help="не скрывать вывод бота")
+    sys.exit(run(parser.parse_args()))
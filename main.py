@@ -6,22 +6,51 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import time
 import datetime
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, total_ordering, wraps
+from bisect import bisect_left, bisect_right
 import pandas as pd
+import numpy as np
 import warnings
-from openpyxl.styles import PatternFill
+from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
 from openpyxl import Workbook
-from threading import Thread, Lock
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.utils import get_column_letter
+from threading import Thread, Lock, Semaphore, Event
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from itertools import islice
 import os
 import sys
+import glob
+import shutil
+import tempfile
 import random
+import math
+import csv
+import heapq
+import zipfile
 import json
+import hashlib
+import sqlite3
+from urllib.parse import urlparse, urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import imaplib
+import ssl
+import select
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import email
 from email.header import decode_header
+from email.utils import parseaddr
 from telegram import Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import RetryAfter, Unauthorized, BadRequest, TimedOut, NetworkError
 from telegram.ext import (
     Updater,
     CommandHandler,
@@ -39,9 +68,36 @@ MAX_TEXT_LENGTH = 100
 LOGIN_URL = 'https://login.1c.ru/login'
 DATA_URL = 'https://releases.1c.ru'
 
+FETCH_BACKEND = "http"
+HTTP_TIMEOUT = 30
+HTTP_POOL_SIZE = 8
+HTTP_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+DEEP_RELEASE_CHECK = False
+DEEP_CRAWL_WORKERS = 8
+DEEP_CRAWL_HOST_RPS = 10
+VERSION_FILTER_PATTERN = re.compile(r'[^0-9.]')
+VERSION_PATTERN = re.compile(r'\d+(?:\.\d+)+')
+RELEASE_DATE_PATTERN = re.compile(r'\b\d{2}\.\d{2}\.(?:\d{4}|\d{2})\b')
+RELEASE_DETAILS = {}
+
 EXCEL_FILE_PATH = "C:/otchet.xlsx"
 SHEET_NAME = "Актуальные версии конфигураций"
+UPDATES_SHEET_NAME = "Список обновлений"
+SECTION_TITLES = ["Конфигурации хозрасчетных организаций", "Платформа 1С", "Конфигурации бюджетных учреждений"]
 REPORT_FOLDER = "C:/"
+REPORT_CACHE_FILE = f"{REPORT_FOLDER}report_cache.json"
+REPORT_CACHE_MAX_AGE = 7 * 86400
+REPORT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+# большие списки обновлений читаются и пишутся кусками, чтобы память не росла вместе с базой клиентов
+REPORT_STREAMING_ROWS = 200_000
+REPORT_CHUNK_SIZE = 20_000
+REPORT_STREAM_FORMAT = 'xlsx'
+REPORT_RED_FILL = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+REPORT_GREEN_FILL = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+REPORT_HEADER_FONT = Font(bold=True)
+REPORT_HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+REPORT_HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
 
 USERNAME = ''
 PASSWORD = ''
@@ -50,8 +106,97 @@ EMAIL_HOST = "imap.mail.ru"
 EMAIL_USER = ""   
 EMAIL_PASS = ""           
 EMAIL_FOLDER = "INBOX"              
+EMAIL_PORT = 993
+EMAIL_USE_SSL = True
+
+# постоянное подключение с IMAP IDLE: письма разбираются сразу по приходу, а не раз в UPDATE_INTERVAL
+MAIL_IDLE_ENABLED = False
+MAIL_IDLE_RENEW = 25 * 60
+MAIL_NOOP_INTERVAL = 60
+MAIL_RECONNECT_BASE = 5
+MAIL_RECONNECT_MAX = 300
+
+MAIL_PIPELINED_FETCH = True
+MAIL_FETCH_BATCH_SIZE = 500
+MAIL_PARSE_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+MAIL_PARSE_CHUNK_SIZE = 100
+MAIL_PARSE_POOL_THRESHOLD = 1000
+# при включенном фильтре тело качается только у писем с "N шт" в теме или от отправителей из списка,
+# остальные сохраняются по одной теме
+MAIL_BODY_FILTER = False
+MAIL_SENDER_FILTER = []
+MAIL_SUBJECT_PATTERN = re.compile(r'(\d+)\s+шт', re.IGNORECASE)
+MAIL_RULES = [
+    {'name': 'warnings', 'keywords': ['предупреждение']},
+    {'name': 'errors', 'keywords': ['ошибка']},
+    {'name': 'updates_count', 'regex': r'(\d+)\s+шт'}
+]
+MAIL_MATCH_CONFIGURATIONS = True
+MAIL_MATCH_CLIENTS = True
+MAIL_HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (SUBJECT DATE FROM MESSAGE-ID)]'
+FETCH_START_PATTERN = re.compile(rb'^\d+ \(')
+BODYSTRUCTURE_TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
 
 excel_lock = Lock()
+report_cache_lock = Lock()
+workbook_cache = {}
+delivery_lock = Lock()
+delivery_cache = {}
+delivery_locks = {}
+file_ids_lock = Lock()
+
+STORAGE_BACKEND = "sqlite"
+DB_FILE_PATH = "C:/otchet.db"
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases (
+    name TEXT PRIMARY KEY,
+    version TEXT,
+    calc_type TEXT,
+    position INTEGER,
+    tracked INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS updates (
+    id INTEGER PRIMARY KEY,
+    client TEXT,
+    product TEXT,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_updates_product ON updates (product);
+CREATE INDEX IF NOT EXISTS idx_updates_client ON updates (client);
+CREATE TABLE IF NOT EXISTS mail_updates (
+    id INTEGER PRIMARY KEY,
+    folder TEXT,
+    uidvalidity INTEGER,
+    uid INTEGER,
+    received_at TEXT,
+    subject TEXT,
+    updates_count INTEGER,
+    warnings_found INTEGER,
+    errors_found INTEGER,
+    body_snippet TEXT,
+    matches TEXT,
+    message_id TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mail_updates_uid ON mail_updates (folder, uidvalidity, uid);
+CREATE TABLE IF NOT EXISTS release_history (
+    id INTEGER PRIMARY KEY,
+    product TEXT NOT NULL,
+    version TEXT NOT NULL,
+    previous_version TEXT,
+    detected_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_release_history_version ON release_history (product, version);
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+"""
+
+BROWSER_POOL_SIZE = 1
+CHROMEDRIVER_PATH = None
+chromedriver_lock = Lock()
+http_session_instance = None
+http_session_lock = Lock()
 
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
@@ -62,8 +207,56 @@ AUTHENTICATED_USERS = set()
 SUBSCRIBED_USERS = set()
 
 UPDATE_INTERVAL = 86400
+SCHEDULE_JITTER = 300
+SCHEDULE_BACKOFF_BASE = 300
+SCHEDULE_BACKOFF_MAX = 6 * 3600
+
+PORTAL_STAGE_TIMEOUT = 900
+MAIL_STAGE_TIMEOUT = 900
+# таймаут одной операции с сокетом IMAP: зависший сервер завершает этап ошибкой, а не держит его вечно
+MAIL_SOCKET_TIMEOUT = min(120, MAIL_STAGE_TIMEOUT)
+STAGE_TIMINGS = {}
+running_stages = set()
+stage_lock = Lock()
+stage_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="stage")
+
+# замеры хранятся в памяти скользящим окном и выгружаются в формате Prometheus
+METRICS_WINDOW = 1000
+METRICS_FILE = "C:/auto1c_metrics.prom"
+METRICS_EXPORT_INTERVAL = 60
+METRICS_HTTP_PORT = None
+METRICS_PREFIX = "auto1c"
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# бот может загрузить документ до 50 МБ; больше - отчет сжимается и делится на части
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+REPORT_COMPRESS_MIN_BYTES = 1024 * 1024
+REPORT_MAX_PARTS = 32
+REPORT_UPLOAD_TIMEOUT = 300
+# file_id уже загруженных документов: повторная отправка в другой чат идет без загрузки файла
+TELEGRAM_FILE_IDS_FILE = "C:/telegram_file_ids.json"
+BROADCAST_WORKERS = 32
+BROADCAST_GLOBAL_RATE = 25
+BROADCAST_CHAT_RATE = 1
+BROADCAST_MAX_RETRIES = 3
+
+JOB_WORKERS = 4
+JOB_LIMITS = {'check': 1, 'report': 2, 'export': 1}
 
 SUBSCRIBERS_FILE = "C:/subscribers.json"
+SCHEDULE_FILE = "C:/schedule.json"
+COOKIES_FILE = "C:/1c_cookies.json"
+MAIL_STATE_FILE = "C:/mail_state.json"
+# при хранении в Excel письма дописываются в журнал, а лист MailUpdates пересобирается по расписанию
+MAIL_LOG_FILE = "C:/mail_updates.jsonl"
+RELEASE_HISTORY_FILE = "C:/release_history.jsonl"
+STALE_RELEASES_THRESHOLD = 2
+MAIL_LOG_MAX_BYTES = 20 * 1024 * 1024
+MAIL_EXPORT_FILE = None
+MAIL_SHEET_NAME = "MailUpdates"
+MAIL_SHEET_HEADER = ["Дата/Время", "Тема письма", "Кол-во обновлений", "Предупреждение", "Ошибка", "Текст (фрагмент)", "Совпадения"]
+mail_log_lock = Lock()
+subscribers_lock = Lock()
 telegram_bot = None
 
 
@@ -79,32 +272,276 @@ def load_subscribers():
 
 def save_subscribers():
     try:
-        with open(SUBSCRIBERS_FILE, "w") as f:
-            json.dump(list(SUBSCRIBED_USERS), f)
+        with subscribers_lock:
+            tmp_path = SUBSCRIBERS_FILE + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(list(SUBSCRIBED_USERS), f)
+            os.replace(tmp_path, SUBSCRIBERS_FILE)
     except Exception as e:
         print("Ошибка при сохранении подписчиков:", e)
 
 SUBSCRIBED_USERS = load_subscribers()
 
-def load_releases_from_excel(excel_file=EXCEL_FILE_PATH, sheet_name=SHEET_NAME):
-    with excel_lock:
-        workbook = openpyxl.load_workbook(excel_file)
-        sheet = workbook[sheet_name]
-        releases = {}
-        for row in range(3, sheet.max_row + 1):
-            if row == 7:
+def load_mail_state():
+    if os.path.exists(MAIL_STATE_FILE):
+        try:
+            with open(MAIL_STATE_FILE, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print("Ошибка при загрузке состояния почты:", e)
+    return {}
+
+def save_mail_state(state):
+    try:
+        tmp_path = MAIL_STATE_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, MAIL_STATE_FILE)
+    except Exception as e:
+        print("Ошибка при сохранении состояния почты:", e)
+
+class Metrics:
+    def __init__(self, window):
+        self.window = window
+        self.lock = Lock()
+        self.samples = {}
+        self.totals = {}
+        self.counters = {}
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.totals[name] = [0, 0.0]
+            self.samples[name].append(seconds)
+            self.totals[name][0] += 1
+            self.totals[name][1] += seconds
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+            self.counters.clear()
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def percentile(values, q):
+        index = max(0, min(len(values) - 1, math.ceil(q * len(values)) - 1))
+        return values[index]
+
+    def snapshot(self):
+        with self.lock:
+            stages = {}
+            for name, samples in self.samples.items():
+                values = sorted(samples)
+                stages[name] = {
+                    'p50': self.percentile(values, 0.5),
+                    'p95': self.percentile(values, 0.95),
+                    'max': values[-1],
+                    'count': self.totals[name][0],
+                    'sum': self.totals[name][1]
+                }
+            return stages, dict(self.counters)
+
+    def prometheus_text(self):
+        stages, counters = self.snapshot()
+        lines = [
+            f"# HELP {METRICS_PREFIX}_stage_seconds Время выполнения этапов (скользящее окно {self.window} замеров)",
+            f"# TYPE {METRICS_PREFIX}_stage_seconds summary"
+        ]
+        for name, data in sorted(stages.items()):
+            lines.append(f'{METRICS_PREFIX}_stage_seconds{{stage="{name}",quantile="0.5"}} {data["p50"]:.6f}')
+            lines.append(f'{METRICS_PREFIX}_stage_seconds{{stage="{name}",quantile="0.95"}} {data["p95"]:.6f}')
+            lines.append(f'{METRICS_PREFIX}_stage_seconds_sum{{stage="{name}"}} {data["sum"]:.6f}')
+            lines.append(f'{METRICS_PREFIX}_stage_seconds_count{{stage="{name}"}} {data["count"]}')
+        lines.append(f"# TYPE {METRICS_PREFIX}_events_total counter")
+        for name, value in sorted(counters.items()):
+            lines.append(f'{METRICS_PREFIX}_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def describe(self):
+        stages, counters = self.snapshot()
+        if not stages and not counters:
+            return "Замеров пока нет."
+        lines = ["Этап: p50 / p95 / max (кол-во)"]
+        for name, data in sorted(stages.items()):
+            lines.append(f"{name}: {data['p50']:.3f} / {data['p95']:.3f} / {data['max']:.3f} с ({data['count']})")
+        if counters:
+            lines.append("")
+            lines.append("Счетчики:")
+            lines.extend(f"{name}: {value}" for name, value in sorted(counters.items()))
+        return "\n".join(lines)
+
+metrics = Metrics(METRICS_WINDOW)
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def write_metrics_file():
+    try:
+        tmp_path = METRICS_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(metrics.prometheus_text())
+        os.replace(tmp_path, METRICS_FILE)
+    except Exception as e:
+        print("Ошибка при сохранении метрик:", e)
+
+def metrics_export_loop():
+    while True:
+        time.sleep(METRICS_EXPORT_INTERVAL)
+        write_metrics_file()
+
+def start_metrics_export():
+    if METRICS_FILE:
+        Thread(target=metrics_export_loop, daemon=True, name="metrics").start()
+    if METRICS_HTTP_PORT:
+        try:
+            server = ThreadingHTTPServer(('127.0.0.1', METRICS_HTTP_PORT), MetricsRequestHandler)
+        except OSError as e:
+            print(f"Не удалось открыть порт {METRICS_HTTP_PORT} для метрик: {e}")
+            return None
+        Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+        print(f"Метрики доступны по адресу http://127.0.0.1:{METRICS_HTTP_PORT}/metrics")
+        return server
+
+def rows_to_frame(rows):
+    header_index = next((i for i, values in enumerate(rows) if any(v is not None for v in values)), None)
+    if header_index is None:
+        return pd.DataFrame()
+    header = rows[header_index]
+    columns = [str(v).strip() if v is not None else f"Unnamed: {i}" for i, v in enumerate(header)]
+    data = [
+        (tuple(values) + (None,) * len(columns))[:len(columns)]
+        for values in rows[header_index + 1:]
+        if any(v is not None for v in values)
+    ]
+    return pd.DataFrame(data, columns=columns)
+
+def detect_tracked_releases(rows):
+    # шапка - первая непустая строка, разделы ("Платформа 1С" и т.п.) и строки без версии пропускаются
+    header_index = next((i for i, values in enumerate(rows) if any(v is not None for v in values)), None)
+    if header_index is None:
+        return {}
+    header = [str(v).strip() if v is not None else '' for v in rows[header_index]]
+    name_col = header.index('Конфигурации') if 'Конфигурации' in header else 0
+    version_col = header.index('Версия') if 'Версия' in header else 2
+
+    releases = {}
+    for row_number, values in enumerate(rows[header_index + 1:], start=header_index + 2):
+        name = values[name_col] if name_col < len(values) else None
+        version = values[version_col] if version_col < len(values) else None
+        if not isinstance(name, str) or not name.strip() or name.strip() in SECTION_TITLES:
+            continue
+        if version is None or not str(version).strip():
+            continue
+        releases[name.strip()] = {'row': row_number, 'column': version_col + 1, 'version': str(version).strip()}
+    return releases
+
+def load_release_sheet(excel_file=None):
+    # в кэше держится только лист версий: список обновлений бывает в сотни тысяч строк,
+    # и закреплять его в памяти на все время работы нельзя
+    excel_file = excel_file or EXCEL_FILE_PATH
+    stat = os.stat(excel_file)
+    cache_key = (stat.st_mtime_ns, stat.st_size)
+    cached = workbook_cache.get(excel_file)
+    if cached and cached[0] == cache_key:
+        return cached[1]
+
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        release_rows = list(workbook[SHEET_NAME].iter_rows(min_row=1, values_only=True))
+    finally:
+        workbook.close()
+
+    data = {
+        'releases': detect_tracked_releases(release_rows),
+        'df_releases': rows_to_frame(release_rows)
+    }
+    workbook_cache[excel_file] = (cache_key, data)
+    return data
+
+@metrics.timed('workbook_load')
+def load_workbook_data(excel_file=None):
+    excel_file = excel_file or EXCEL_FILE_PATH
+    data = dict(load_release_sheet(excel_file))
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        update_rows = list(workbook[UPDATES_SHEET_NAME].iter_rows(min_row=1, values_only=True)) if UPDATES_SHEET_NAME in workbook.sheetnames else []
+    finally:
+        workbook.close()
+    data['df_updates'] = rows_to_frame(update_rows)
+    return data
+
+def load_workbook_clients(excel_file=None):
+    workbook = openpyxl.load_workbook(excel_file or EXCEL_FILE_PATH, read_only=True, data_only=True)
+    try:
+        if UPDATES_SHEET_NAME not in workbook.sheetnames:
+            return []
+        client_col = None
+        clients = {}
+        for values in workbook[UPDATES_SHEET_NAME].iter_rows(values_only=True):
+            if not any(v is not None for v in values):
+                continue
+            if client_col is None:
+                header = [str(v).strip() if v is not None else '' for v in values]
+                if 'Клиент' not in header:
+                    return []
+                client_col = header.index('Клиент')
                 continue
-            config_name = sheet.cell(row=row, column=1).value
-            current_version = sheet.cell(row=row, column=3).value
-            if config_name and current_version:
-                releases[config_name.strip()] = {'row': row, 'version': current_version.strip()}
-        return releases, workbook, sheet
+            client = values[client_col] if client_col < len(values) else None
+            if client is not None:
+                clients[str(client)] = None
+        return list(clients)
+    finally:
+        workbook.close()
+
+def load_releases_from_excel(excel_file=None, sheet_name=SHEET_NAME):
+    with excel_lock:
+        releases = load_release_sheet(excel_file)['releases']
+        # книга для записи откроется в update_releases_in_excel, только если версия изменилась
+        return {name: dict(data) for name, data in releases.items()}, None, None
 
-def update_releases_in_excel(releases, workbook, sheet_name=SHEET_NAME):
+def update_releases_in_excel(releases, workbook=None, sheet_name=SHEET_NAME):
     with excel_lock:
+        if workbook is None:
+            workbook = openpyxl.load_workbook(EXCEL_FILE_PATH)
         sheet = workbook[sheet_name]
         for name, data in releases.items():
-            sheet.cell(row=data['row'], column=3, value=data['version'])
+            cell = sheet.cell(row=data['row'], column=data.get('column', 3))
+            if cell.value != data['version']:
+                cell.value = data['version']
         workbook.save(EXCEL_FILE_PATH)
         print(f"Файл {EXCEL_FILE_PATH} успешно обновлен.")
 
@@ -113,42 +550,415 @@ def extract_first_version_from_html(version_column):
     version_links = version_column.find_all('a')
     return version_links[0].get_text(strip=True) if version_links else None
 
+class ReleasesTableParser(HTMLParser):
+    # разбирает только первый <tbody> страницы релизов, не строя дерево документа
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.links = {}
+        self.found_table = False
+        self.done = False
+        self.tbody_depth = 0
+        self.row = None
+        self.cell_index = -1
+        self.in_link = False
+        self.text = []
+        self.text_target = None
+
+    def flush_text(self):
+        # HTMLParser режет текст на границах кусков feed(): узел собирается целиком и обрезается один раз,
+        # как get_text(strip=True) в BeautifulSoup
+        if self.text:
+            self.text_target.append(''.join(self.text).strip())
+        self.text = []
+        self.text_target = None
+
+    def finish_row(self):
+        self.flush_text()
+        if self.row is not None and self.cell_index >= 2:
+            name = ''.join(self.row['name'])
+            version = ''.join(self.row['version']) if self.row['version'] is not None else None
+            self.rows.append((name, version or None))
+            if self.row['link']:
+                self.links[name] = self.row['link']
+        self.row = None
+        self.in_link = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        self.flush_text()
+        if tag == 'tbody':
+            self.found_table = True
+            self.tbody_depth += 1
+        elif not self.tbody_depth:
+            return
+        elif tag == 'tr':
+            self.finish_row()
+            self.row = {'name': [], 'version': None, 'link': None}
+            self.cell_index = -1
+        elif tag == 'td' and self.row is not None:
+            self.cell_index += 1
+            self.in_link = False
+        elif tag == 'a' and self.row is not None and self.cell_index == 0 and self.row['link'] is None:
+            self.row['link'] = dict(attrs).get('href')
+        elif tag == 'a' and self.row is not None and self.cell_index == 1 and self.row['version'] is None:
+            self.row['version'] = []
+            self.in_link = True
+
+    def handle_endtag(self, tag):
+        if self.done or not self.tbody_depth:
+            return
+        self.flush_text()
+        if tag == 'a':
+            self.in_link = False
+        elif tag == 'tr':
+            self.finish_row()
+        elif tag == 'tbody':
+            self.tbody_depth -= 1
+            if not self.tbody_depth:
+                self.finish_row()
+                self.done = True
+
+    def handle_data(self, data):
+        if self.done or self.row is None:
+            return
+        if self.cell_index == 0:
+            target = self.row['name']
+        elif self.in_link:
+            target = self.row['version']
+        else:
+            return
+        if target is not self.text_target:
+            self.flush_text()
+            self.text_target = target
+        self.text.append(data)
+
+def iter_release_rows(page_source, chunk_size=65536):
+    chunks = page_source
+    if isinstance(page_source, str):
+        chunks = (page_source[i:i + chunk_size] for i in range(0, len(page_source), chunk_size))
+    parser = ReleasesTableParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        rows, parser.rows = parser.rows, []
+        yield from rows
+        if parser.done:
+            return
+    parser.close()
+    parser.finish_row()
+    yield from parser.rows
+
+def collect_project_links(page_source):
+    parser = ReleasesTableParser()
+    parser.feed(page_source)
+    parser.close()
+    parser.finish_row()
+    return parser.links
+
+class VersionHistoryParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.tbody_depth = 0
+        self.done = False
+        self.cells = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == 'tbody':
+            self.tbody_depth += 1
+        elif self.tbody_depth and tag == 'tr':
+            self.cells = []
+            self.rows.append(self.cells)
+        elif self.tbody_depth and tag == 'td' and self.cells is not None:
+            self.cells.append([])
+
+    def handle_endtag(self, tag):
+        if tag == 'tbody' and self.tbody_depth and not self.done:
+            self.tbody_depth -= 1
+            if not self.tbody_depth:
+                self.done = True
+
+    def handle_data(self, data):
+        if not self.done and self.cells:
+            self.cells[-1].append(data.strip())
+
+def parse_version_history(page_source):
+    parser = VersionHistoryParser()
+    parser.feed(page_source)
+    parser.close()
+    history = []
+    for cells in parser.rows:
+        texts = [' '.join(text for text in cell if text) for cell in cells]
+        version_match = VERSION_PATTERN.search(texts[0]) if texts else None
+        if not version_match:
+            continue
+        date = None
+        for text in texts[1:]:
+            date_match = RELEASE_DATE_PATTERN.search(text)
+            if date_match:
+                date = date_match.group()
+                break
+        history.append((version_match.group(), date))
+    return history
+
 def truncate_text(text, max_length=MAX_TEXT_LENGTH):
     return text[:max_length] + "..." if text and len(text) > max_length else text
 
 def filter_version(version):
-    return re.sub(r'[^0-9.]', '', version)
+    return VERSION_FILTER_PATTERN.sub('', version)
 
 def extract_first_version(version_string):
     return version_string.split(' ', 1)[0].strip()
 
+def version_key(version):
+    # хвостовые нули отбрасываются: сравнение кортежей тогда равносильно дополнению нулями до общей длины
+    try:
+        parts = [int(part) for part in filter_version(version).split('.')]
+    except ValueError:
+        return None
+    while len(parts) > 1 and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+@total_ordering
+class Version:
+    __slots__ = ('raw', 'key')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.key = version_key(raw)
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self.key == other.key
+
+    def __lt__(self, other):
+        if self.key is None or other.key is None:
+            raise ValueError(f"Ошибка сравнения версий: '{self.raw}' vs '{other.raw}'")
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"Version('{self.raw}')"
+
+    def __str__(self):
+        return self.raw
+
+@lru_cache(maxsize=16384)
+def parse_version(version):
+    return Version(str(version))
+
 def compare_versions(current_version, new_version):
+    current = current_version if isinstance(current_version, Version) else parse_version(current_version)
+    new = new_version if isinstance(new_version, Version) else parse_version(new_version)
+    if current.key is None or new.key is None:
+        print(f"Ошибка сравнения версий: '{filter_version(current.raw)}' vs '{filter_version(new.raw)}'")
+        return False
+    return new.key > current.key
+
+class VersionIndex:
+    # по каждому продукту - отсортированный список известных релизов для поиска через bisect
+    def __init__(self):
+        self.lock = Lock()
+        self.releases = {}
+        self.listeners = []
+
+    def add_release(self, product, version):
+        key = parse_version(version).key
+        if key is None:
+            return False
+        with self.lock:
+            keys = self.releases.setdefault(product, [])
+            position = bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                return False
+            keys.insert(position, key)
+        for listener in self.listeners:
+            listener(product, key)
+        return True
+
+    def releases_behind(self, product, version):
+        return self.releases_behind_key(product, parse_version(version).key)
+
+    def releases_behind_key(self, product, key):
+        with self.lock:
+            keys = self.releases.get(product)
+            if key is None or not keys:
+                return None
+            return len(keys) - bisect_right(keys, key)
+
+    def products_behind(self, versions, n):
+        behind = []
+        for product, version in versions.items():
+            count = self.releases_behind(product, version)
+            if count is not None and count > n:
+                behind.append((product, count))
+        return sorted(behind, key=lambda item: item[1], reverse=True)
+
+version_index = VersionIndex()
+
+class StalenessIndex:
+    # клиент -> продукт -> на сколько релизов отстает; пересчитываются только затронутые пары
+    def __init__(self, index):
+        self.index = index
+        self.lock = Lock()
+        self.entries = {}
+        self.by_product = {}
+        self.buckets = {}
+        self.source = None
+        index.listeners.append(self.on_release)
+
+    def place(self, pair, key, count):
+        old = self.entries.get(pair)
+        if old is not None and old[1] is not None:
+            bucket = self.buckets[old[1]]
+            bucket.discard(pair)
+            if not bucket:
+                del self.buckets[old[1]]
+        self.entries[pair] = (key, count)
+        if count is not None:
+            self.buckets.setdefault(count, set()).add(pair)
+
+    def set_version(self, client, product, version):
+        pair = (client, product)
+        key = parse_version(version).key
+        with self.lock:
+            self.by_product.setdefault(product, {})[client] = key
+            self.place(pair, key, self.index.releases_behind(product, version) if key is not None else None)
+
+    def remove(self, client, product):
+        pair = (client, product)
+        with self.lock:
+            if pair not in self.entries:
+                return
+            self.place(pair, None, None)
+            del self.entries[pair]
+            clients = self.by_product.get(product, {})
+            clients.pop(client, None)
+            if not clients:
+                self.by_product.pop(product, None)
+
+    def on_release(self, product, key):
+        # счетчик берется из индекса заново, а не +1: set_version мог уже увидеть этот релиз,
+        # а у продукта без прежних релизов клиентам на новой версии и выше нужно поставить 0
+        with self.lock:
+            for client, client_key in self.by_product.get(product, {}).items():
+                if client_key is None:
+                    continue
+                pair = (client, product)
+                if client_key >= key and self.entries[pair][1] is not None:
+                    continue
+                self.place(pair, client_key, self.index.releases_behind_key(product, client_key))
+
+    def sync(self, rows, source=None):
+        # строки списка обновлений сравниваются с индексом, версии пересчитываются только у изменившихся
+        current = {}
+        for client, product, version in rows:
+            if client is None or product is None or version is None:
+                continue
+            current[(str(client), str(product))] = str(version)
+        with self.lock:
+            known = {pair: key for pair, (key, count) in self.entries.items()}
+        for pair in set(known) - set(current):
+            self.remove(*pair)
+        changed = 0
+        for pair, version in current.items():
+            if pair not in known or known[pair] != parse_version(version).key:
+                self.set_version(pair[0], pair[1], version)
+                changed += 1
+        self.source = source
+        return changed
+
+    def behind(self, n):
+        with self.lock:
+            found = [(client, product, count) for count, pairs in self.buckets.items() if count > n for client, product in pairs]
+        return sorted(found, key=lambda item: (-item[2], item[0], item[1]))
+
+    def client(self, client):
+        with self.lock:
+            return {product: self.entries[(client, product)][1] for product, clients in self.by_product.items() if client in clients}
+
+staleness_index = StalenessIndex(version_index)
+
+
+def resolve_chromedriver():
+    global CHROMEDRIVER_PATH
+    with chromedriver_lock:
+        if CHROMEDRIVER_PATH is None:
+            CHROMEDRIVER_PATH = ChromeDriverManager().install()
+    return CHROMEDRIVER_PATH
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        print(f"Ошибка при закрытии браузера: {e}")
 
-    current_version = filter_version(current_version)
-    new_version = filter_version(new_version)
+def driver_is_alive(driver):
     try:
-        current_parts = list(map(int, current_version.split('.')))
-        new_parts = list(map(int, new_version.split('.')))
-        max_length = max(len(current_parts), len(new_parts))
-        current_parts.extend([0] * (max_length - len(current_parts)))
-        new_parts.extend([0] * (max_length - len(current_parts)))
-        return new_parts > current_parts
-    except ValueError:
-        print(f"Ошибка сравнения версий: '{current_version}' vs '{new_version}'")
+        driver.execute_script("return 1")
+        return True
+    except Exception:
         return False
 
+class BrowserPool:
+    def __init__(self, size):
+        self.slots = Semaphore(size)
+        self.lock = Lock()
+        self.idle = []
+
+    @metrics.timed('chrome_start')
+    def create_driver(self):
+        service = Service(resolve_chromedriver())
+        options = webdriver.ChromeOptions()
+        options.add_argument("--headless")
+        return webdriver.Chrome(service=service, options=options)
+
+    def take_driver(self):
+        while True:
+            with self.lock:
+                driver = self.idle.pop() if self.idle else None
+            if driver is None:
+                return self.create_driver()
+            if driver_is_alive(driver):
+                return driver
+            print("Браузер из пула не отвечает, запускаем новый.")
+            quit_driver(driver)
+
+    @contextmanager
+    def driver(self):
+        with self.slots:
+            driver = self.take_driver()
+            healthy = False
+            try:
+                yield driver
+                healthy = True
+            finally:
+                # после ошибки состояние страницы неизвестно, такой браузер в пул не возвращаем
+                if healthy:
+                    with self.lock:
+                        self.idle.append(driver)
+                else:
+                    quit_driver(driver)
+
+    def close(self):
+        with self.lock:
+            drivers, self.idle = self.idle, []
+        for driver in drivers:
+            quit_driver(driver)
+
+browser_pool = BrowserPool(BROWSER_POOL_SIZE)
 
 @contextmanager
 def selenium_driver():
-    service = Service(ChromeDriverManager().install())
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    driver = webdriver.Chrome(service=service, options=options)
-    try:
+    with browser_pool.driver() as driver:
         yield driver
-    finally:
-        driver.quit()
 
+@metrics.timed('portal_login')
 def login(driver):
     driver.get(LOGIN_URL)
     driver.find_element(By.ID, "username").send_keys(USERNAME)
@@ -157,167 +967,1289 @@ def login(driver):
         raise Exception("Ошибка авторизации!")
     print("Авторизация успешна!")
 
-def check_updates():
-    with selenium_driver() as driver:
-        login(driver)
-        driver.get(DATA_URL)
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        table_body = soup.find('tbody')
-        if not table_body:
-            print("Данные не найдены.")
-            return []
-        releases_dict, workbook, sheet = load_releases_from_excel()
-        updated_products = []
-
-        for row in table_body.find_all('tr'):
-            cells = row.find_all('td')
-            if len(cells) >= 3:
-                name = cells[0].get_text(strip=True)
-                current_version = extract_first_version_from_html(cells[1])
-                if current_version and name in releases_dict:
-                    old_version = releases_dict[name]['version']
-                    if compare_versions(old_version, current_version):
-                        releases_dict[name]['version'] = current_version
-                        updated_products.append(f"Обновлено: {name} - {current_version}")
-
-        if updated_products:
-            update_releases_in_excel(releases_dict, workbook)
-            print("\n".join(updated_products))
-        else:
-            print("Обновлений нет.")
-        return updated_products
-
-def check_email_updates():
-
-    print("Проверяем новые письма...")
+def save_cookies(driver):
+    try:
+        cookies = driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+        tmp_path = COOKIES_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cookies, f)
+        os.replace(tmp_path, COOKIES_FILE)
+    except Exception as e:
+        print("Ошибка при сохранении cookies:", e)
 
+def restore_cookies(driver):
+    if not os.path.exists(COOKIES_FILE):
+        return False
     try:
-        mail = imaplib.IMAP4_SSL(EMAIL_HOST)
-        mail.login(EMAIL_USER, EMAIL_PASS)
-        mail.select(EMAIL_FOLDER)
+        with open(COOKIES_FILE, "r") as f:
+            cookies = json.load(f)
+        driver.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+        return True
     except Exception as e:
-        print(f"Не удалось подключиться к почтовому серверу: {e}")
-        return []
+        print("Ошибка при загрузке cookies:", e)
+        return False
 
-    criterion = '(ALL)'
+def session_expired(driver):
+    return urlparse(driver.current_url).netloc == urlparse(LOGIN_URL).netloc
 
-    try:
-        result, data = mail.search(None, criterion)
-        if result != 'OK':
-            print("Не удалось выполнить поиск писем.")
-            mail.logout()
-            return []
+def open_releases_page(driver):
+    driver.get(DATA_URL)
+    if not session_expired(driver):
+        return
+    if restore_cookies(driver):
+        driver.get(DATA_URL)
+        if not session_expired(driver):
+            print("Сессия восстановлена из cookies.")
+            return
+    login(driver)
+    save_cookies(driver)
+    driver.get(DATA_URL)
+
+class HttpPortalClient:
+    def __init__(self, session):
+        self.session = session
+        self.current_url = ''
+        self.page_source = ''
+
+    def load(self, response):
+        response.raise_for_status()
+        self.current_url = response.url
+        self.page_source = response.text
+
+    def get(self, url):
+        self.load(self.session.get(url, timeout=HTTP_TIMEOUT))
+
+    def post(self, url, data):
+        self.load(self.session.post(url, data=data, timeout=HTTP_TIMEOUT))
+
+def get_http_session():
+    global http_session_instance
+    with http_session_lock:
+        if http_session_instance is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=2,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['User-Agent'] = HTTP_USER_AGENT
+            http_session_instance = session
+    return http_session_instance
+
+@contextmanager
+def http_session():
+    # сессия requests общая и живет весь процесс: соединения и cookies CAS переиспользуются
+    yield HttpPortalClient(get_http_session())
+
+@metrics.timed('portal_login')
+def http_login(client):
+    if not session_expired(client):
+        client.get(LOGIN_URL)
+    soup = BeautifulSoup(client.page_source, 'html.parser')
+    username_input = soup.find('input', id='username')
+    form = username_input.find_parent('form') if username_input else soup.find('form')
+    if not form:
+        raise Exception("Форма авторизации не найдена!")
+    fields = {}
+    for field in form.find_all('input'):
+        if field.get('name'):
+            fields[field['name']] = field.get('value', '')
+    fields[username_input.get('name', 'username') if username_input else 'username'] = USERNAME
+    fields['password'] = PASSWORD
+    client.post(urljoin(client.current_url, form.get('action') or client.current_url), fields)
+    if session_expired(client):
+        raise Exception("Ошибка авторизации!")
+    print("Авторизация успешна!")
 
-        email_ids = data[0].split()
-        parsed_results = []
+def open_releases_page_http(client):
+    client.get(DATA_URL)
+    if session_expired(client):
+        http_login(client)
+        client.get(DATA_URL)
+    if session_expired(client):
+        raise Exception("Ошибка авторизации!")
 
-        for eid in email_ids:
-            res, msg_data = mail.fetch(eid, '(RFC822)')
-            if res != 'OK':
+class RateLimiter:
+    # не чаще rate запросов в секунду на каждый ключ (хост, чат и т.п.)
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = Lock()
+        self.next_slot = {}
+
+    def wait(self, key):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(key, now))
+            self.next_slot[key] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def defer(self, key, seconds):
+        with self.lock:
+            now = time.monotonic()
+            self.next_slot[key] = max(self.next_slot.get(key, now), now + seconds)
+
+def fetch_release_history(url, limiter):
+    client = HttpPortalClient(get_http_session())
+    limiter.wait(urlparse(url).netloc)
+    client.get(url)
+    if session_expired(client):
+        raise Exception("сессия портала истекла")
+    return parse_version_history(client.page_source)
+
+@metrics.timed('release_history_crawl')
+def crawl_release_details(project_links, names):
+    targets = {name: urljoin(DATA_URL, project_links[name]) for name in names if name in project_links}
+    if not targets:
+        return {}
+    with http_session() as client:
+        open_releases_page_http(client)
+
+    limiter = RateLimiter(DEEP_CRAWL_HOST_RPS)
+    details = {}
+    with ThreadPoolExecutor(max_workers=DEEP_CRAWL_WORKERS) as executor:
+        futures = {executor.submit(fetch_release_history, url, limiter): name for name, url in targets.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                details[name] = future.result()
+            except Exception as e:
+                print(f"Не удалось получить историю версий {name}: {e}")
+    print(f"Загружена история версий для {len(details)} из {len(targets)} конфигураций.")
+    return details
+
+def latest_release_version(history):
+    parsed = [parse_version(version) for version, date in history]
+    parsed = [version for version in parsed if version.key is not None]
+    return max(parsed).raw if parsed else None
+
+@metrics.timed('portal_fetch')
+def fetch_releases_page():
+    if FETCH_BACKEND == 'http':
+        try:
+            with http_session() as client:
+                open_releases_page_http(client)
+                if '<tbody' not in client.page_source:
+                    raise Exception("таблица релизов не найдена в ответе")
+                return client.page_source
+        except Exception as e:
+            print(f"HTTP-загрузка страницы релизов не удалась, используем Selenium: {e}")
+    with selenium_driver() as driver:
+        open_releases_page(driver)
+        return driver.page_source
+
+def check_updates():
+    page_source = fetch_releases_page()
+    if '<tbody' not in page_source.lower():
+        print("Данные не найдены.")
+        return []
+    releases_dict, workbook = load_releases()
+    updated_products = []
+
+    release_details = {}
+    if DEEP_RELEASE_CHECK:
+        try:
+            release_details = crawl_release_details(collect_project_links(page_source), releases_dict)
+            RELEASE_DETAILS.update(release_details)
+        except Exception as e:
+            print(f"Ошибка при загрузке истории версий: {e}")
+
+    detected = []
+    for name, history in release_details.items():
+        for version, date in history:
+            if version_index.add_release(name, version):
+                detected.append((name, version))
+
+    previous_versions = {}
+    with metrics.timer('releases_parse'):
+        for name, current_version in iter_release_rows(page_source):
+            if release_details.get(name):
+                current_version = latest_release_version(release_details[name]) or current_version
+            if not current_version:
                 continue
+            if version_index.add_release(name, current_version):
+                detected.append((name, current_version))
+            if name in releases_dict:
+                new_version = parse_version(current_version)
+                if compare_versions(releases_dict[name]['parsed'], new_version):
+                    previous_versions[name] = releases_dict[name]['version']
+                    releases_dict[name]['version'] = current_version
+                    releases_dict[name]['parsed'] = new_version
+                    updated_products.append(f"Обновлено: {name} - {current_version}")
+    metrics.inc('releases_updated', len(updated_products))
+
+    if detected:
+        detected_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        save_release_history([
+            {
+                'product': name,
+                'version': version,
+                'previous_version': previous_versions.get(name) if releases_dict.get(name, {}).get('version') == version else None,
+                'detected_at': detected_at
+            }
+            for name, version in detected
+        ])
+
+    if updated_products:
+        save_releases(releases_dict, workbook)
+        print("\n".join(updated_products))
+    else:
+        print("Обновлений нет.")
+    return updated_products
+
+def get_uidvalidity(mail, folder=None):
+    folder = folder or EMAIL_FOLDER
+    typ, data = mail.response('UIDVALIDITY')
+    if data and data[0]:
+        return int(data[0])
+    typ, data = mail.status(folder, '(UIDVALIDITY)')
+    match = re.search(rb'UIDVALIDITY (\d+)', data[0]) if typ == 'OK' else None
+    return int(match.group(1)) if match else None
+
+def decode_subject(raw_subject):
+    if not raw_subject:
+        return ""
+    subject, encoding = decode_header(raw_subject)[0]
+    if isinstance(subject, bytes):
+        subject = subject.decode(encoding if encoding else 'utf-8', errors='ignore')
+    return subject
+
+def keywords_regex(words):
+    # слова собираются в префиксное дерево, поэтому проверка в каждой позиции не зависит от их количества
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+class MailClassifier:
+    def __init__(self, rules):
+        self.rules = rules
+        # ключ - (слово в нижнем регистре, только целым словом)
+        self.keywords = {}
+        self.regex_rules = {}
+        parts = []
+        for rule in rules:
+            whole_words = bool(rule.get('whole_words'))
+            for keyword in rule.get('keywords', []):
+                keyword = str(keyword).strip()
+                if keyword:
+                    self.keywords.setdefault((keyword.lower(), whole_words), []).append((rule['name'], keyword))
+            if rule.get('regex'):
+                group = f"rule{len(self.regex_rules)}"
+                self.regex_rules[group] = (rule['name'], re.compile(rule['regex']).groups)
+                parts.append(f"(?P<{group}>{rule['regex']})")
+        self.pattern = re.compile('|'.join(parts), re.IGNORECASE) if parts else None
+        self.keyword_lengths = sorted({len(word) for word, _ in self.keywords})
+
+        # слова ищутся внутри просмотра вперед: совпадения могут перекрываться, и слово
+        # внутри более длинного (клиент в названии конфигурации) не теряется
+        self.keyword_patterns = []
+        for whole_words in (False, True):
+            words = [word for word, whole in self.keywords if whole == whole_words]
+            if words:
+                body = keywords_regex(words)
+                if whole_words:
+                    body = rf'(?<!\w){body}(?!\w)'
+                self.keyword_patterns.append((whole_words, re.compile(f'(?=({body}))', re.IGNORECASE)))
+
+    def keyword_matches(self, text, whole_words, match):
+        # регулярное выражение дает самое длинное слово в позиции, более короткие с того же места добираются здесь
+        start, found = match.start(1), match.group(1)
+        for length in self.keyword_lengths:
+            if length > len(found):
+                break
+            end = start + length
+            if whole_words and end < len(text) and (text[end].isalnum() or text[end] == '_'):
+                continue
+            yield from self.keywords.get((found[:length].lower(), whole_words), ())
+
+    def classify(self, text):
+        if not text:
+            return {}
+        found = []
+        for whole_words, pattern in self.keyword_patterns:
+            for match in pattern.finditer(text):
+                for rule_name, keyword in self.keyword_matches(text, whole_words, match):
+                    found.append((match.start(), rule_name, keyword))
+        if self.pattern:
+            for match in self.pattern.finditer(text):
+                rule_name, inner_groups = self.regex_rules[match.lastgroup]
+                value = match.group(self.pattern.groupindex[match.lastgroup] + 1) if inner_groups else match.group()
+                found.append((match.start(), rule_name, value))
+
+        matches = {}
+        for _, rule_name, value in sorted(found, key=lambda item: item[0]):
+            matches.setdefault(rule_name, []).append(value)
+        return {rule_name: list(dict.fromkeys(values)) for rule_name, values in matches.items()}
+
+def load_classifier_vocabulary():
+    try:
+        if STORAGE_BACKEND == 'sqlite':
+            with db_connection() as connection:
+                configurations = [row[0] for row in connection.execute("SELECT name FROM releases WHERE tracked = 1")]
+                clients = [row[0] for row in connection.execute("SELECT DISTINCT client FROM updates WHERE client IS NOT NULL")]
+        else:
+            with excel_lock:
+                configurations = list(load_release_sheet()['releases'])
+                clients = load_workbook_clients()
+    except Exception as e:
+        print(f"Не удалось загрузить справочники для разбора писем: {e}")
+        return [], []
+    return configurations, clients
+
+def build_mail_rules(configurations=(), clients=()):
+    rules = [dict(rule) for rule in MAIL_RULES]
+    if MAIL_MATCH_CONFIGURATIONS and configurations:
+        rules.append({'name': 'configurations', 'keywords': list(configurations), 'whole_words': True})
+    if MAIL_MATCH_CLIENTS and clients:
+        rules.append({'name': 'clients', 'keywords': list(clients), 'whole_words': True})
+    return rules
+
+def refresh_mail_classifier():
+    global mail_classifier
+    mail_classifier = MailClassifier(build_mail_rules(*load_classifier_vocabulary()))
+    return mail_classifier
+
+mail_classifier = MailClassifier(MAIL_RULES)
+
+def format_mail_matches(matches):
+    return "; ".join(f"{rule_name}: {', '.join(map(str, values))}" for rule_name, values in matches.items())
+
+def message_id_of(msg):
+    return str(msg["Message-ID"] or '').strip() or None
+
+def build_mail_record(uid, subject, body_text, message_id=None):
+    updates_count = None
+    match = MAIL_SUBJECT_PATTERN.search(subject)
+    if match:
+        updates_count = int(match.group(1))
+    matches = mail_classifier.classify(body_text)
+
+    return {
+        "uid": int(uid),
+        "message_id": message_id,
+        "subject": subject,
+        "updates_count": updates_count,
+        "warnings_found": 'warnings' in matches,
+        "errors_found": 'errors' in matches,
+        "matches": matches,
+        "body_snippet": body_text[:200]
+    }
 
-            raw_email = msg_data[0][1]
+def parse_email_message(uid, raw_email):
+    msg = email.message_from_bytes(raw_email)
+    subject = decode_subject(msg["Subject"])
+
+    body_text = ""
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            cdispo = str(part.get('Content-Disposition'))
+            if ctype == 'text/plain' and 'attachment' not in cdispo:
+                charset = part.get_content_charset()
+                try:
+                    body_text = part.get_payload(decode=True).decode(charset if charset else 'utf-8', errors='ignore')
+                except:
+                    pass
+    else:
+        payload = msg.get_payload(decode=True)
+        if payload:
             try:
-                msg = email.message_from_bytes(raw_email)
-            except:
-                continue
+                body_text = payload.decode(msg.get_content_charset() or 'utf-8', errors='ignore')
+            except LookupError:
+                body_text = payload.decode('utf-8', errors='ignore')
 
-            subject, encoding = decode_header(msg["Subject"])[0]
-            if isinstance(subject, bytes):
-                subject = subject.decode(encoding if encoding else 'utf-8', errors='ignore')
+    return build_mail_record(uid, subject, body_text, message_id_of(msg))
 
+def parse_email_chunk(chunk):
+    records = []
+    for uid, raw_email in chunk:
+        try:
+            records.append(parse_email_message(uid, raw_email))
+        except:
+            continue
+    return records
+
+def decode_mail_chunk(chunk):
+    records = []
+    for uid, subject, message_id, payload, charset, encoding in chunk:
+        try:
+            body_text = decode_part_payload(payload, charset, encoding) if payload is not None else ""
+        except Exception as e:
+            # битое письмо не должно останавливать разбор: сохраняем его по теме, отметка last_uid идет дальше
+            print(f"Не удалось декодировать письмо UID {int(uid)}: {e}")
             body_text = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    ctype = part.get_content_type()
-                    cdispo = str(part.get('Content-Disposition'))
-                    if ctype == 'text/plain' and 'attachment' not in cdispo:
-                        charset = part.get_content_charset()
+        records.append(build_mail_record(uid, subject, body_text, message_id))
+    return records
+
+def init_mail_worker(rules):
+    global mail_classifier
+    mail_classifier = MailClassifier(rules)
+
+class MailParseStage:
+    # разбор писем уходит в пул процессов кусками, пока соединение продолжает качать следующие
+    def __init__(self, func, total):
+        self.func = func
+        self.pending = []
+        self.chunks = []
+        self.results = []
+        self.pool = None
+        if MAIL_PARSE_WORKERS > 1 and total >= MAIL_PARSE_POOL_THRESHOLD:
+            try:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=MAIL_PARSE_WORKERS,
+                    initializer=init_mail_worker,
+                    initargs=(mail_classifier.rules,)
+                )
+            except (OSError, NotImplementedError) as e:
+                print(f"Не удалось запустить пул процессов для разбора писем: {e}")
+
+    def add(self, item):
+        self.pending.append(item)
+        if len(self.pending) >= MAIL_PARSE_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        chunk, self.pending = self.pending, []
+        if not chunk:
+            return
+        metrics.inc('mail_messages_parsed', len(chunk))
+        if self.pool:
+            self.chunks.append((chunk, self.pool.submit(self.func, chunk)))
+        else:
+            with metrics.timer('mime_decode'):
+                self.results.extend(self.func(chunk))
+
+    def finish(self):
+        self.flush()
+        if self.pool:
+            # в режиме пула учитывается только ожидание, которое не перекрылось загрузкой писем
+            try:
+                with metrics.timer('mime_decode'):
+                    for chunk, future in self.chunks:
                         try:
-                            body_text = part.get_payload(decode=True).decode(charset if charset else 'utf-8', errors='ignore')
-                        except:
-                            pass
+                            self.results.extend(future.result())
+                        except BrokenProcessPool:
+                            print("Пул процессов разбора писем аварийно завершился, оставшиеся письма разбираются здесь.")
+                            self.results.extend(self.func(chunk))
+            finally:
+                self.pool.shutdown(wait=True, cancel_futures=True)
+        return self.results
+
+@metrics.timed('imap_fetch')
+def fetch_email_records(mail, email_uids):
+    stage = MailParseStage(parse_email_chunk, len(email_uids))
+    for uid in email_uids:
+        res, msg_data = mail.uid('fetch', uid, '(RFC822)')
+        if res != 'OK':
+            continue
+        try:
+            stage.add((uid, msg_data[0][1]))
+        except:
+            continue
+    return stage.finish()
+
+def compress_uid_set(uids):
+    numbers = sorted(int(uid) for uid in uids)
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+def split_fetch_response(data):
+    # imaplib отдает ответ FETCH вперемешку: кортежи (префикс, литерал) и хвосты вида b')'
+    messages = []
+    for item in data:
+        if isinstance(item, tuple):
+            if FETCH_START_PATTERN.match(item[0]) or not messages:
+                messages.append([item[0], [item[1]]])
             else:
-                body_text = msg.get_payload(decode=True)
-                if body_text:
-                    try:
-                        body_text = body_text.decode('utf-8', errors='ignore')
-                    except:
-                        body_text = str(body_text)
-
-            updates_count = None
-            match = re.search(r'(\d+)\s+шт', subject, re.IGNORECASE)
-            if match:
-                updates_count = int(match.group(1))
-            warnings_found = False
-            errors_found = False
-
-            if "предупреждение" in body_text.lower():
-                warnings_found = True
-            if "ошибка" in body_text.lower():
-                errors_found = True
-
-            parsed_results.append({
-                "subject": subject,
-                "updates_count": updates_count,
-                "warnings_found": warnings_found,
-                "errors_found": errors_found,
-                "body_snippet": body_text[:200]
-            })
+                messages[-1][0] += item[0]
+                messages[-1][1].append(item[1])
+        elif isinstance(item, bytes):
+            if FETCH_START_PATTERN.match(item):
+                messages.append([item, []])
+            elif messages:
+                messages[-1][0] += item
+    return messages
+
+def fetch_response_uid(meta):
+    match = re.search(rb'UID (\d+)', meta)
+    return int(match.group(1)) if match else None
+
+def parse_bodystructure(meta):
+    pos = meta.find(b'BODYSTRUCTURE ')
+    if pos < 0:
+        return None
+    stack = [[]]
+    for match in BODYSTRUCTURE_TOKEN.finditer(meta, pos + len(b'BODYSTRUCTURE ')):
+        token = match.group()
+        if token == b'(':
+            stack.append([])
+        elif token == b')':
+            if len(stack) == 1:
+                break
+            item = stack.pop()
+            stack[-1].append(item)
+            if len(stack) == 1:
+                break
+        elif token.startswith(b'"'):
+            stack[-1].append(token[1:-1].replace(b'\\"', b'"').replace(b'\\\\', b'\\').decode('utf-8', errors='ignore'))
+        else:
+            stack[-1].append(None if token.upper() == b'NIL' else token.decode('ascii', errors='ignore'))
+    return stack[0][0] if stack[0] and isinstance(stack[0][0], list) else None
+
+def find_plain_text_part(structure):
+    # та же часть, что берет parse_email_message: у простого письма - тело целиком при любом типе,
+    # у составного - последняя text/plain, не вложение
+    if not isinstance(structure, list) or not structure:
+        return None
+    if not isinstance(structure[0], list):
+        encoding = (structure[5] or '7bit').lower() if len(structure) > 5 else '7bit'
+        return '1', part_charset(structure), encoding
+    parts = list(plain_text_parts(structure))
+    return parts[-1] if parts else None
+
+def part_charset(structure):
+    params = structure[2] if len(structure) > 2 and isinstance(structure[2], list) else []
+    for key, value in zip(params[::2], params[1::2]):
+        if key and key.lower() == 'charset':
+            return value
+    return None
+
+def plain_text_parts(structure, section=''):
+    if isinstance(structure[0], list):
+        for index, child in enumerate(structure, start=1):
+            if not isinstance(child, list) or not child:
+                break
+            yield from plain_text_parts(child, f"{section}.{index}" if section else str(index))
+        return
+
+    ctype = (structure[0] or '').lower()
+    subtype = (structure[1] or '').lower() if len(structure) > 1 else ''
+    if ctype != 'text' or subtype != 'plain':
+        return
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and disposition and (disposition[0] or '').lower() == 'attachment':
+        return
+    encoding = (structure[5] or '7bit').lower() if len(structure) > 5 else '7bit'
+    yield section or '1', part_charset(structure), encoding
+
+def decode_part_payload(payload, charset, encoding):
+    if encoding in ('base64', 'quoted-printable'):
+        # декодирует сам пакет email, как get_payload(decode=True) в parse_email_message:
+        # обрезанный base64 дочитывается, а совсем битый возвращается как есть
+        part = email.message_from_bytes(f"Content-Transfer-Encoding: {encoding}\r\n\r\n".encode('ascii') + payload)
+        payload = part.get_payload(decode=True) or b''
+    try:
+        return payload.decode(charset if charset else 'utf-8', errors='ignore')
+    except LookupError:
+        return payload.decode('utf-8', errors='ignore')
+
+def is_relevant_mail(subject, sender):
+    if MAIL_SUBJECT_PATTERN.search(subject):
+        return True
+    sender = parseaddr(sender)[1].lower()
+    return any(pattern.lower() in sender for pattern in MAIL_SENDER_FILTER)
+
+@metrics.timed('imap_fetch')
+def fetch_email_records_pipelined(mail, email_uids):
+    stage = MailParseStage(decode_mail_chunk, len(email_uids))
+    for i in range(0, len(email_uids), MAIL_FETCH_BATCH_SIZE):
+        batch = email_uids[i:i + MAIL_FETCH_BATCH_SIZE]
+        res, data = mail.uid('fetch', compress_uid_set(batch), f'(UID BODYSTRUCTURE {MAIL_HEADER_FIELDS})')
+        if res != 'OK':
+            continue
+
+        wanted = {}
+        for meta, literals in split_fetch_response(data):
+            uid = fetch_response_uid(meta)
+            if uid is None:
+                continue
+            headers = email.message_from_bytes(literals[0] if literals else b'')
+            subject = decode_subject(headers["Subject"])
+            if MAIL_BODY_FILTER and not is_relevant_mail(subject, str(headers["From"] or '')):
+                wanted[uid] = (subject, message_id_of(headers), None)
+                continue
+            structure = parse_bodystructure(meta)
+            part = find_plain_text_part(structure) if structure else ('1', None, '7bit')
+            wanted[uid] = (subject, message_id_of(headers), part)
+
+        # тело качаем одной командой на каждый номер части, а не по письму
+        sections = {}
+        for uid, (subject, message_id, part) in wanted.items():
+            if part:
+                sections.setdefault(part[0], []).append(uid)
+        bodies = {}
+        for section, uids in sections.items():
+            res, data = mail.uid('fetch', compress_uid_set(uids), f'(UID BODY.PEEK[{section}])')
+            if res != 'OK':
+                continue
+            for meta, literals in split_fetch_response(data):
+                uid = fetch_response_uid(meta)
+                if uid is not None and literals:
+                    bodies[uid] = literals[0]
+
+        for uid in sorted(wanted):
+            subject, message_id, part = wanted[uid]
+            if part and uid in bodies:
+                stage.add((uid, subject, message_id, bodies[uid], part[1], part[2]))
+            else:
+                stage.add((uid, subject, message_id, None, None, None))
+    return stage.finish()
+
+@metrics.timed('imap_connect')
+def connect_mailbox():
+    if EMAIL_USE_SSL:
+        mail = imaplib.IMAP4_SSL(EMAIL_HOST, EMAIL_PORT, timeout=MAIL_SOCKET_TIMEOUT)
+    else:
+        mail = imaplib.IMAP4(EMAIL_HOST, EMAIL_PORT, timeout=MAIL_SOCKET_TIMEOUT)
+    mail.login(EMAIL_USER, EMAIL_PASS)
+    mail.select(EMAIL_FOLDER)
+    return mail
 
+def check_email_updates():
+
+    print("Проверяем новые письма...")
+    refresh_mail_classifier()
+
+    try:
+        mail = connect_mailbox()
+    except Exception as e:
+        print(f"Не удалось подключиться к почтовому серверу: {e}")
+        return []
+
+    try:
+        parsed_results = sync_mail_folder(mail)
         mail.close()
         mail.logout()
     except Exception as e:
         print(f"Ошибка при чтении писем: {e}")
         return []
+    return parsed_results
 
-    if parsed_results:
-        save_email_updates_to_excel(parsed_results)
+def sync_mail_folder(mail):
+    # плановая проверка и IDLE-слушатель двигают одну и ту же отметку last_uid
+    with mail_sync_lock:
+        return sync_mail_folder_locked(mail)
+
+def sync_mail_folder_locked(mail):
+    mail_state = load_mail_state()
+    folder_state = mail_state.get(EMAIL_FOLDER, {})
+    uidvalidity = get_uidvalidity(mail)
+    last_uid = folder_state.get('last_uid', 0)
+    resync = folder_state.get('uidvalidity') != uidvalidity
+    if resync:
+        if folder_state:
+            print(f"UIDVALIDITY папки {EMAIL_FOLDER} изменился, выполняется полная синхронизация.")
+        last_uid = 0
+
+    criterion = f'UID {last_uid + 1}:*'
+
+    result, data = mail.uid('search', None, criterion)
+    if result != 'OK':
+        raise imaplib.IMAP4.error("не удалось выполнить поиск писем")
+
+    # "n:*" всегда возвращает хотя бы последнее письмо, даже если его UID меньше n
+    email_uids = [uid for uid in data[0].split() if int(uid) > last_uid]
+
+    if MAIL_PIPELINED_FETCH:
+        parsed_results = fetch_email_records_pipelined(mail, email_uids)
+    else:
+        parsed_results = fetch_email_records(mail, email_uids)
 
     for item in parsed_results:
-        if item["warnings_found"] or item["errors_found"]:
-            message = (
-                f"Внимание!\n"
-                f"В письме «{item['subject']}» обнаружено предупреждение или ошибка.\n"
-                f"Кол-во обновлений (если указано): {item['updates_count']}"
-            )
-            for chat_id in SUBSCRIBED_USERS:
-                try:
-                    telegram_bot.send_message(chat_id=chat_id, text=message)
-                except Exception as e:
-                    print(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+        item["folder"] = EMAIL_FOLDER
+        item["uidvalidity"] = uidvalidity
+
+    if resync and parsed_results:
+        # после смены UIDVALIDITY те же письма приходят с новыми UID: уже сохраненные узнаем по Message-ID
+        known = known_message_ids(item["message_id"] for item in parsed_results if item["message_id"])
+        parsed_results = [item for item in parsed_results if item["message_id"] not in known]
+
+    if parsed_results:
+        save_email_updates(parsed_results)
+
+    if email_uids:
+        mail_state[EMAIL_FOLDER] = {
+            'uidvalidity': uidvalidity,
+            'last_uid': max(int(uid) for uid in email_uids)
+        }
+        save_mail_state(mail_state)
+    elif resync:
+        mail_state[EMAIL_FOLDER] = {'uidvalidity': uidvalidity, 'last_uid': 0}
+        save_mail_state(mail_state)
+
+    if not folder_state:
+        # первая синхронизация загружает историю папки, рассылать по ней уведомления не нужно
+        if parsed_results:
+            print(f"Первая синхронизация папки {EMAIL_FOLDER}: сохранено {len(parsed_results)} писем без уведомлений.")
+        return parsed_results
+
+    alerts = [
+        f"• «{item['subject']}», кол-во обновлений (если указано): {item['updates_count']}"
+        for item in parsed_results
+        if item["warnings_found"] or item["errors_found"]
+    ]
+    if alerts:
+        broadcast("Внимание!\nВ письмах обнаружены предупреждения или ошибки:\n" + "\n".join(alerts))
 
     return parsed_results
 
-def save_email_updates_to_excel(parsed_results):
+def read_idle_response(mail, tag):
+    lines = []
+    while True:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("соединение закрыто сервером")
+        if line.startswith(tag + b' '):
+            if not line[len(tag) + 1:].upper().startswith(b'OK'):
+                raise imaplib.IMAP4.error(line.decode('utf-8', errors='ignore').strip())
+            return lines
+        lines.append(line)
+
+def buffered_data(mail):
+    # заглядываем в буфер mail.file, не блокируясь: сокет на время переводится в неблокирующий режим
+    sock = mail.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+def socket_readable(mail, timeout):
+    sock = mail.socket()
+    if getattr(sock, 'pending', None) and sock.pending():
+        return True
+    # строки, пришедшие одним пакетом с "+ idling", уже прочитаны в буфер mail.file, и select их не увидит
+    if buffered_data(mail):
+        return True
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+def wait_for_new_mail(mail, stop_event, renew=None):
+    renew = renew or MAIL_IDLE_RENEW
+    # imaplib не умеет IDLE, поэтому команда отправляется вручную, а ответ читается уже после DONE
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    first = mail.readline()
+    if not first.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"сервер отклонил IDLE: {first.decode('utf-8', errors='ignore').strip()}")
+
+    deadline = time.monotonic() + renew
+    lines = []
+    while not stop_event.is_set() and time.monotonic() < deadline:
+        if socket_readable(mail, min(1, max(0, deadline - time.monotonic()))):
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("соединение закрыто сервером")
+            lines.append(line)
+            break
+
+    mail.send(b'DONE\r\n')
+    lines.extend(read_idle_response(mail, tag))
+    return any(re.match(rb'\* \d+ (EXISTS|RECENT)', line, re.IGNORECASE) for line in lines)
+
+def wait_with_noop(mail, stop_event, interval=None):
+    interval = interval or MAIL_NOOP_INTERVAL
+    if stop_event.wait(interval):
+        return False
+    mail.noop()
+    # imaplib складывает непрошенные EXISTS в untagged_responses, а не в ответ NOOP
+    changed = [mail.response(name)[1] for name in ('EXISTS', 'RECENT')]
+    return any(data and data[0] for data in changed)
+
+class MailIdleListener:
+    def __init__(self):
+        self.stop_event = Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run, daemon=True, name="mail-idle")
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self):
+        failures = 0
+        while not self.stop_event.is_set():
+            mail = None
+            try:
+                refresh_mail_classifier()
+                mail = connect_mailbox()
+                print(f"Подключение к почте для IDLE установлено ({EMAIL_FOLDER}).")
+                failures = 0
+                # письма, пришедшие пока соединения не было, забираем сразу
+                self.process(mail)
+                result, data = mail.capability()
+                use_idle = result == 'OK' and b'IDLE' in data[0].upper().split()
+                if not use_idle:
+                    print("Сервер не поддерживает IDLE, новые письма проверяются командой NOOP.")
+                while not self.stop_event.is_set():
+                    if use_idle:
+                        changed = wait_for_new_mail(mail, self.stop_event)
+                    else:
+                        changed = wait_with_noop(mail, self.stop_event)
+                    if changed:
+                        self.process(mail)
+            except Exception as e:
+                if self.stop_event.is_set():
+                    break
+                failures += 1
+                delay = min(MAIL_RECONNECT_MAX, MAIL_RECONNECT_BASE * 2 ** (failures - 1))
+                print(f"Соединение IDLE с почтой потеряно: {e}. Переподключение через {delay} с.")
+                self.stop_event.wait(delay)
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+
+    def process(self, mail):
+        parsed_results = sync_mail_folder(mail)
+        if parsed_results:
+            print(f"IDLE: обработано новых писем: {len(parsed_results)}")
+
+mail_sync_lock = Lock()
+mail_listener = MailIdleListener()
+
+def mail_row(item):
+    return [
+        item.get("received_at", ""),
+        item["subject"],
+        item["updates_count"] if item["updates_count"] is not None else "",
+        "Да" if item["warnings_found"] else "",
+        "Да" if item["errors_found"] else "",
+        item["body_snippet"],
+        item["matches_text"] if "matches_text" in item else format_mail_matches(item.get("matches", {}))
+    ]
+
+def mail_log_segments():
+    folder = os.path.dirname(MAIL_LOG_FILE) or "."
+    stem, ext = os.path.splitext(os.path.basename(MAIL_LOG_FILE))
+    if not os.path.isdir(folder):
+        return []
+    rotated = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.startswith(stem + ".") and name.endswith(ext) and name != os.path.basename(MAIL_LOG_FILE)
+    )
+    return rotated + ([MAIL_LOG_FILE] if os.path.exists(MAIL_LOG_FILE) else [])
+
+def rotate_mail_log():
+    stem, ext = os.path.splitext(MAIL_LOG_FILE)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    os.replace(MAIL_LOG_FILE, f"{stem}.{timestamp}{ext}")
+
+def seed_mail_log_from_excel():
+    # история, накопленная до появления журнала, переносится из листа один раз
+    if not os.path.exists(EXCEL_FILE_PATH):
+        return []
     with excel_lock:
-        if not os.path.exists(EXCEL_FILE_PATH):
-            wb = Workbook()
+        wb = openpyxl.load_workbook(EXCEL_FILE_PATH, read_only=True)
+        try:
+            if MAIL_SHEET_NAME not in wb.sheetnames:
+                return []
+            rows = list(wb[MAIL_SHEET_NAME].iter_rows(min_row=2, values_only=True))
+        finally:
+            wb.close()
+    records = []
+    for row in rows:
+        row = list(row) + [None] * (len(MAIL_SHEET_HEADER) - len(row))
+        if not any(value is not None for value in row):
+            continue
+        records.append({
+            "received_at": str(row[0] or ""),
+            "subject": row[1] or "",
+            "updates_count": row[2] if row[2] != "" else None,
+            "warnings_found": row[3] == "Да",
+            "errors_found": row[4] == "Да",
+            "body_snippet": row[5] or "",
+            "matches_text": row[6] or ""
+        })
+    return records
+
+def append_mail_log(parsed_results):
+    now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with mail_log_lock:
+        records = []
+        if not mail_log_segments():
+            records = seed_mail_log_from_excel()
+        elif os.path.getsize(MAIL_LOG_FILE) >= MAIL_LOG_MAX_BYTES:
+            rotate_mail_log()
+        records += [dict(item, received_at=now_str) for item in parsed_results]
+        prefix = ""
+        if os.path.exists(MAIL_LOG_FILE) and os.path.getsize(MAIL_LOG_FILE):
+            with open(MAIL_LOG_FILE, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    prefix = "\n"
+        with open(MAIL_LOG_FILE, "a", encoding="utf-8") as f:
+            f.write(prefix)
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    print(f"Записано {len(parsed_results)} писем в журнал {MAIL_LOG_FILE}.")
+
+def iter_mail_log():
+    for path in mail_log_segments():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # недописанная строка после аварийного завершения
+                    continue
+
+def compact_mail_log():
+    records = {}
+    for number, record in enumerate(iter_mail_log()):
+        key = (record.get("folder"), record.get("uidvalidity"), record.get("uid"))
+        records.setdefault(key if record.get("uid") is not None else number, record)
+    return list(records.values())
+
+def export_mail_log(export_path=None):
+    export_path = export_path or MAIL_EXPORT_FILE
+    with mail_log_lock:
+        records = compact_mail_log()
+    if export_path:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(MAIL_SHEET_NAME)
+        ws.append(MAIL_SHEET_HEADER)
+        for item in records:
+            ws.append(mail_row(item))
+        wb.save(export_path)
+    else:
+        export_path = EXCEL_FILE_PATH
+        with excel_lock:
+            if os.path.exists(EXCEL_FILE_PATH):
+                wb = openpyxl.load_workbook(EXCEL_FILE_PATH)
+            else:
+                wb = Workbook()
+            if MAIL_SHEET_NAME in wb.sheetnames:
+                del wb[MAIL_SHEET_NAME]
+            ws = wb.create_sheet(MAIL_SHEET_NAME)
+            ws.append(MAIL_SHEET_HEADER)
+            for item in records:
+                ws.append(mail_row(item))
             wb.save(EXCEL_FILE_PATH)
+    print(f"Лист '{MAIL_SHEET_NAME}' ({len(records)} писем) сохранен в {export_path}.")
+    return export_path
 
-        wb = openpyxl.load_workbook(EXCEL_FILE_PATH)
-        sheet_name = "MailUpdates"
+@contextmanager
+def db_connection():
+    connection = sqlite3.connect(DB_FILE_PATH, timeout=30)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def init_db():
+    with db_connection() as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(DB_SCHEMA)
+        mail_columns = [row[1] for row in connection.execute("PRAGMA table_info(mail_updates)")]
+        if 'matches' not in mail_columns:
+            connection.execute("ALTER TABLE mail_updates ADD COLUMN matches TEXT")
+        if 'message_id' not in mail_columns:
+            connection.execute("ALTER TABLE mail_updates ADD COLUMN message_id TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_mail_updates_message_id ON mail_updates (message_id)")
+        has_releases = connection.execute("SELECT 1 FROM releases LIMIT 1").fetchone()
+    if not has_releases and os.path.exists(EXCEL_FILE_PATH):
+        print(f"База {DB_FILE_PATH} пуста, выполняется импорт из {EXCEL_FILE_PATH}...")
+        import_excel_to_db()
+
+def import_excel_to_db(excel_file=None):
+    excel_file = excel_file or EXCEL_FILE_PATH
+    with excel_lock:
+        data = load_workbook_data(excel_file)
+    tracked, df_releases, df_updates = data['releases'], data['df_releases'], data['df_updates']
+
+    release_rows = []
+    for position, record in enumerate(df_releases.to_dict('records')):
+        name = record.get('Конфигурации')
+        if pd.isna(name):
+            continue
+        name = str(name).strip()
+        version = record.get('Версия')
+        calc_type = record.get('Вид расчета')
+        if name in tracked:
+            version = tracked[name]['version']
+        release_rows.append((
+            name,
+            None if pd.isna(version) else str(version),
+            None if calc_type is None or pd.isna(calc_type) else str(calc_type),
+            position,
+            1 if name in tracked else 0
+        ))
+
+    update_rows = [
+        (
+            None if pd.isna(client) else str(client),
+            None if pd.isna(product) else str(product),
+            None if pd.isna(version) else str(version)
+        )
+        for client, product, version in zip(df_updates['Клиент'], df_updates['Программный продукт'], df_updates['Новый'])
+    ]
 
-        if sheet_name not in wb.sheetnames:
-            wb.create_sheet(sheet_name)
-            ws = wb[sheet_name]
-            ws.append(["Дата/Время", "Тема письма", "Кол-во обновлений", "Предупреждение", "Ошибка", "Текст (фрагмент)"])
-        else:
-            ws = wb[sheet_name]
+    with db_connection() as connection:
+        connection.execute("DELETE FROM releases")
+        connection.executemany(
+            "INSERT OR REPLACE INTO releases (name, version, calc_type, position, tracked) VALUES (?, ?, ?, ?, ?)",
+            release_rows
+        )
+        connection.execute("DELETE FROM updates")
+        connection.executemany("INSERT INTO updates (client, product, version) VALUES (?, ?, ?)", update_rows)
+        bump_data_version(connection, 'updates')
+    print(f"Импортировано конфигураций: {len(release_rows)}, строк списка обновлений: {len(update_rows)}.")
+
+def bump_data_version(connection, name):
+    # id в updates после DELETE начинаются заново, поэтому перезаливка списка той же длины
+    # отличима от прежней только по этой отметке
+    connection.execute(
+        "INSERT OR REPLACE INTO data_versions (name, version) VALUES (?, ?)",
+        (name, f"{time.time_ns()}:{os.urandom(4).hex()}")
+    )
+
+def load_releases_from_db():
+    with db_connection() as connection:
+        rows = connection.execute(
+            "SELECT name, version, position FROM releases WHERE tracked = 1 AND version IS NOT NULL AND version <> ''"
+        ).fetchall()
+    return {name: {'row': position, 'version': version.strip()} for name, version, position in rows}
+
+def update_releases_in_db(releases):
+    with db_connection() as connection:
+        connection.executemany(
+            "UPDATE releases SET version = ? WHERE name = ? AND version IS NOT ?",
+            [(data['version'], name, data['version']) for name, data in releases.items()]
+        )
+    print(f"База {DB_FILE_PATH} успешно обновлена.")
+
+def save_email_updates_to_db(parsed_results):
+    now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db_connection() as connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO mail_updates "
+            "(folder, uidvalidity, uid, received_at, subject, updates_count, warnings_found, errors_found, body_snippet, matches, message_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    item.get("folder", EMAIL_FOLDER),
+                    item.get("uidvalidity"),
+                    item.get("uid"),
+                    now_str,
+                    item["subject"],
+                    item["updates_count"],
+                    int(item["warnings_found"]),
+                    int(item["errors_found"]),
+                    item["body_snippet"],
+                    json.dumps(item.get("matches", {}), ensure_ascii=False),
+                    item.get("message_id")
+                )
+                for item in parsed_results
+            ]
+        )
+    print(f"Записано {len(parsed_results)} писем в базу {DB_FILE_PATH}.")
+
+def load_data_from_db():
+    with db_connection() as connection:
+        df_releases = pd.read_sql_query(
+            'SELECT name AS "Конфигурации", version AS "Версия", calc_type AS "Вид расчета" FROM releases ORDER BY position',
+            connection
+        )
+        df_updates = pd.read_sql_query(
+            'SELECT client AS "Клиент", product AS "Программный продукт", version AS "Новый" FROM updates ORDER BY id',
+            connection
+        )
+    return df_releases, df_updates
+
+def export_db_to_excel(export_path=None):
+    if export_path is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M")
+        export_path = f"{REPORT_FOLDER}export_{timestamp}.xlsx"
+    df_releases, df_updates = load_data_from_db()
+    with db_connection() as connection:
+        df_mail = pd.read_sql_query(
+            'SELECT received_at AS "Дата/Время", subject AS "Тема письма", updates_count AS "Кол-во обновлений", '
+            'CASE WHEN warnings_found THEN \'Да\' ELSE \'\' END AS "Предупреждение", '
+            'CASE WHEN errors_found THEN \'Да\' ELSE \'\' END AS "Ошибка", '
+            'body_snippet AS "Текст (фрагмент)", matches FROM mail_updates ORDER BY id',
+            connection
+        )
+        df_history = pd.read_sql_query(
+            'SELECT product AS "Конфигурация", version AS "Версия", previous_version AS "Предыдущая версия", '
+            'detected_at AS "Обнаружена" FROM release_history ORDER BY id',
+            connection
+        )
+    df_mail["Совпадения"] = [format_mail_matches(json.loads(value)) if value else "" for value in df_mail.pop("matches")]
+    with pd.ExcelWriter(export_path, engine='openpyxl') as writer:
+        df_releases.to_excel(writer, sheet_name=SHEET_NAME, index=False)
+        df_updates.to_excel(writer, sheet_name=UPDATES_SHEET_NAME, index=False)
+        df_mail.to_excel(writer, sheet_name=MAIL_SHEET_NAME, index=False)
+        df_history.to_excel(writer, sheet_name="История релизов", index=False)
+    print(f"Экспорт сохранен: {export_path}")
+    return export_path
+
+def save_release_history_to_db(events):
+    with db_connection() as connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO release_history (product, version, previous_version, detected_at) VALUES (?, ?, ?, ?)",
+            [(event['product'], event['version'], event['previous_version'], event['detected_at']) for event in events]
+        )
+
+def load_release_history_from_db(product=None):
+    query = "SELECT product, version, previous_version, detected_at FROM release_history"
+    params = ()
+    if product is not None:
+        query += " WHERE product = ?"
+        params = (product,)
+    with db_connection() as connection:
+        rows = connection.execute(query + " ORDER BY id", params).fetchall()
+    return [dict(zip(('product', 'version', 'previous_version', 'detected_at'), row)) for row in rows]
+
+def append_release_history_file(events):
+    with open(RELEASE_HISTORY_FILE, "a", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+def load_release_history_file(product=None):
+    events = []
+    if not os.path.exists(RELEASE_HISTORY_FILE):
+        return events
+    with open(RELEASE_HISTORY_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if product is None or event.get('product') == product:
+                events.append(event)
+    return events
+
+def save_release_history(events):
+    if STORAGE_BACKEND == 'sqlite':
+        save_release_history_to_db(events)
+    else:
+        append_release_history_file(events)
+    print(f"В историю релизов добавлено записей: {len(events)}")
+
+def load_release_history(product=None):
+    if STORAGE_BACKEND == 'sqlite':
+        return load_release_history_from_db(product)
+    return load_release_history_file(product)
+
+release_history_loaded = Event()
+release_history_lock = Lock()
 
-        for item in parsed_results:
-            now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ws.append([
-                now_str,
-                item["subject"],
-                item["updates_count"] if item["updates_count"] is not None else "",
-                "Да" if item["warnings_found"] else "",
-                "Да" if item["errors_found"] else "",
-                item["body_snippet"]
-            ])
+def ensure_release_history_loaded():
+    # индекс версий живет в памяти, после перезапуска он восстанавливается из истории
+    if release_history_loaded.is_set():
+        return
+    with release_history_lock:
+        if release_history_loaded.is_set():
+            return
+        try:
+            for event in load_release_history():
+                version_index.add_release(event['product'], event['version'])
+        except Exception as e:
+            print(f"Не удалось загрузить историю релизов: {e}")
+        release_history_loaded.set()
+
+def refresh_staleness_index():
+    ensure_release_history_loaded()
+    source = report_source_fingerprint()
+    if staleness_index.source != source:
+        df_releases, df_updates = load_data()
+        for name, version in zip(df_releases['Конфигурации'], df_releases['Версия']):
+            if isinstance(version, str):
+                version_index.add_release(name, version)
+        staleness_index.sync(df_updates[['Клиент', 'Программный продукт', 'Новый']].itertuples(index=False, name=None), source)
+    return staleness_index
+
+def releases_behind_column(df_report, counts=None):
+    # одна проверка на уникальную пару продукт/версия, а не на каждую строку отчета
+    counts = {} if counts is None else counts
+    pairs = list(zip(df_report['Программный продукт'], df_report['Новый'].astype(str)))
+    for product, version in set(pairs):
+        if (product, version) not in counts:
+            counts[(product, version)] = version_index.releases_behind(product, version)
+    return [counts[pair] for pair in pairs]
+
+@metrics.timed('releases_load')
+def load_releases():
+    ensure_release_history_loaded()
+    if STORAGE_BACKEND == 'sqlite':
+        releases_dict, workbook = load_releases_from_db(), None
+    else:
+        releases_dict, workbook, sheet = load_releases_from_excel()
+    for name, data in releases_dict.items():
+        data['parsed'] = parse_version(data['version'])
+        version_index.add_release(name, data['version'])
+    return releases_dict, workbook
+
+@metrics.timed('releases_save')
+def save_releases(releases, workbook=None):
+    if STORAGE_BACKEND == 'sqlite':
+        update_releases_in_db(releases)
+    else:
+        update_releases_in_excel(releases, workbook)
+
+def known_message_ids(message_ids):
+    message_ids = set(message_ids)
+    if not message_ids:
+        return set()
+    if STORAGE_BACKEND == 'sqlite':
+        known = set()
+        batch = list(message_ids)
+        with db_connection() as connection:
+            for i in range(0, len(batch), 500):
+                chunk = batch[i:i + 500]
+                known.update(row[0] for row in connection.execute(
+                    f"SELECT message_id FROM mail_updates WHERE message_id IN ({','.join('?' * len(chunk))})", chunk
+                ))
+        return known
+    with mail_log_lock:
+        return {record.get("message_id") for record in iter_mail_log()} & message_ids
+
+@metrics.timed('mail_save')
+def save_email_updates(parsed_results):
+    if STORAGE_BACKEND == 'sqlite':
+        save_email_updates_to_db(parsed_results)
+    else:
+        append_mail_log(parsed_results)
 
-        wb.save(EXCEL_FILE_PATH)
-    print(f"Записано {len(parsed_results)} писем в лист '{sheet_name}' файла {EXCEL_FILE_PATH}.")
+def export_data():
+    if STORAGE_BACKEND == 'sqlite':
+        return export_db_to_excel()
+    return export_mail_log()
 
 
 def snake_game():
@@ -426,11 +2358,13 @@ def snake_game():
 
     input("Нажмите Enter для возврата в меню...")
 
+@metrics.timed('report_load')
 def load_data():
+    if STORAGE_BACKEND == 'sqlite':
+        return load_data_from_db()
     with excel_lock:
-        df_releases = pd.read_excel(EXCEL_FILE_PATH, sheet_name='Актуальные версии конфигураций')
-        df_updates = pd.read_excel(EXCEL_FILE_PATH, sheet_name='Список обновлений')
-    return df_releases, df_updates
+        data = load_workbook_data()
+    return data['df_releases'].copy(), data['df_updates'].copy()
 
 def filter_configurations(df_releases, choice):
     config_map = {
@@ -441,9 +2375,238 @@ def filter_configurations(df_releases, choice):
         return df_releases[df_releases['Вид расчета'] == config_map[choice]]
     return df_releases
 
-def process_report(choice=None):
-    df_releases, df_updates = load_data()
+def classify_updates(df_updates, releases_dict):
+    products = df_updates['Программный продукт']
+    expected = products.map(releases_dict)
+    status = pd.Series(np.where(df_updates['Новый'] == expected, 'Да', 'Нет'), index=df_updates.index)
+    df_updates['Актуальный'] = status.where(products.isin(list(releases_dict)))
+    return df_updates.dropna(subset=['Актуальный'])[['Клиент', 'Программный продукт', 'Новый', 'Актуальный']]
+
+def build_summary(df_releases, df_report, releases_dict):
+    counts = df_report[df_report['Актуальный'] == 'Да'].groupby('Программный продукт').size()
+    return summary_from_counts(df_releases, counts, releases_dict)
+
+def summary_from_counts(df_releases, counts, releases_dict):
+    configs = [config for config in df_releases['Конфигурации'].unique() if config not in SECTION_TITLES]
+    return pd.DataFrame({
+        'Конфигурация': configs,
+        'Актуальная версия': [releases_dict.get(config, 'Неизвестно') for config in configs],
+        'Обновлено': [int(counts.get(config, 0)) for config in configs]
+    }, columns=['Конфигурация', 'Актуальная версия', 'Обновлено'])
+
+def header_cells(sheet, values):
+    cells = []
+    for value in values:
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.font = REPORT_HEADER_FONT
+        cell.border = REPORT_HEADER_BORDER
+        cell.alignment = REPORT_HEADER_ALIGNMENT
+        cells.append(cell)
+    return cells
+
+def frame_rows(df):
+    for row in df.itertuples(index=False, name=None):
+        yield [None if value is None or (isinstance(value, float) and value != value) else value for value in row]
+
+@metrics.timed('report_write')
+def write_report(report_path, df_report, summary_df):
+    # write-only книга пишет строки потоком, заливка задается одним правилом условного форматирования
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Отчет')
+    sheet.append(header_cells(sheet, df_report.columns))
+    for row in frame_rows(df_report):
+        sheet.append(row)
+
+    if len(df_report):
+        cell_range = f"A2:{get_column_letter(len(df_report.columns))}{len(df_report) + 1}"
+        status_column = get_column_letter(df_report.columns.get_loc('Актуальный') + 1)
+        sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'${status_column}2="Да"'], fill=REPORT_GREEN_FILL))
+        sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'${status_column}2="Нет"'], fill=REPORT_RED_FILL))
+
+    sheet.append([])
+    sheet.append([])
+    sheet.append(header_cells(sheet, summary_df.columns))
+    for row in frame_rows(summary_df):
+        sheet.append(row)
+    workbook.save(report_path)
+
+def update_list_size(limit=None):
+    if STORAGE_BACKEND == 'sqlite':
+        with db_connection() as connection:
+            return connection.execute("SELECT count(*) FROM updates").fetchone()[0]
+    # read-only книга читает файл лениво, поэтому блокировка держится до закрытия
+    with excel_lock:
+        workbook = openpyxl.load_workbook(EXCEL_FILE_PATH, read_only=True)
+        try:
+            if UPDATES_SHEET_NAME not in workbook.sheetnames:
+                return 0
+            sheet = workbook[UPDATES_SHEET_NAME]
+            # обычно размер берется из тега dimension; write-only книги его не заполняют,
+            # тогда строки считаются потоком, но не дальше limit
+            if sheet.max_row and sheet.max_row > 1:
+                return sheet.max_row - 1
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+            if limit is not None:
+                rows = islice(rows, limit + 2)
+            return max(0, sum(1 for _ in rows) - 1)
+        finally:
+            workbook.close()
+
+@contextmanager
+def excel_snapshot():
+    # потоковый отчет читает книгу минутами: держать excel_lock все это время нельзя,
+    # поэтому под блокировкой снимается копия, и дальше читается она
+    if STORAGE_BACKEND == 'sqlite':
+        yield None
+        return
+    handle, snapshot_path = tempfile.mkstemp(suffix='.xlsx', prefix='report_source_')
+    os.close(handle)
+    try:
+        with excel_lock:
+            shutil.copyfile(EXCEL_FILE_PATH, snapshot_path)
+        yield snapshot_path
+    finally:
+        os.remove(snapshot_path)
+
+def load_release_frame(excel_file=None):
+    if STORAGE_BACKEND == 'sqlite':
+        with db_connection() as connection:
+            return pd.read_sql_query(
+                'SELECT name AS "Конфигурации", version AS "Версия", calc_type AS "Вид расчета" FROM releases ORDER BY position',
+                connection
+            )
+    with excel_lock:
+        workbook = openpyxl.load_workbook(excel_file or EXCEL_FILE_PATH, read_only=True, data_only=True)
+        try:
+            return rows_to_frame(list(workbook[SHEET_NAME].iter_rows(values_only=True)))
+        finally:
+            workbook.close()
+
+def iter_update_chunks(chunk_size=None, excel_file=None):
+    chunk_size = chunk_size or REPORT_CHUNK_SIZE
+    columns = ['Клиент', 'Программный продукт', 'Новый']
+    if STORAGE_BACKEND == 'sqlite':
+        with db_connection() as connection:
+            yield from pd.read_sql_query(
+                'SELECT client AS "Клиент", product AS "Программный продукт", version AS "Новый" FROM updates ORDER BY id',
+                connection, chunksize=chunk_size
+            )
+        return
+
+    with excel_snapshot() if excel_file is None else nullcontext(excel_file) as source:
+        yield from iter_workbook_update_chunks(source, chunk_size, columns)
 
+def iter_workbook_update_chunks(excel_file, chunk_size, columns):
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        header = None
+        chunk = []
+        for values in workbook[UPDATES_SHEET_NAME].iter_rows(values_only=True):
+            if not any(v is not None for v in values):
+                continue
+            if header is None:
+                header = [str(v).strip() if v is not None else f"Unnamed: {i}" for i, v in enumerate(values)]
+                continue
+            chunk.append((tuple(values) + (None,) * len(header))[:len(header)])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=header)[columns]
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)[columns]
+    finally:
+        workbook.close()
+
+class StreamingReportWriter:
+    def __init__(self, report_path, columns):
+        self.report_path = report_path
+        self.columns = list(columns)
+        self.rows = 0
+        if report_path.endswith('.csv'):
+            self.file = open(report_path, 'w', newline='', encoding='utf-8-sig')
+            self.writer = csv.writer(self.file, delimiter=';')
+            self.writer.writerow(self.columns)
+            self.workbook = None
+        else:
+            self.file = None
+            self.workbook = Workbook(write_only=True)
+            self.sheet = self.workbook.create_sheet('Отчет')
+            self.sheet.append(header_cells(self.sheet, self.columns))
+
+    def write(self, df):
+        self.write_rows(frame_rows(df))
+
+    def write_rows(self, rows):
+        for row in rows:
+            if self.workbook is None:
+                self.writer.writerow(row)
+            else:
+                self.sheet.append(row)
+            self.rows += 1
+
+    def close(self, summary_df):
+        if self.workbook is None:
+            self.writer.writerow([])
+            self.writer.writerow(summary_df.columns)
+            for row in frame_rows(summary_df):
+                self.writer.writerow(row)
+            self.file.close()
+            return
+        if self.rows:
+            cell_range = f"A2:{get_column_letter(len(self.columns))}{self.rows + 1}"
+            status_column = get_column_letter(self.columns.index('Актуальный') + 1)
+            self.sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'${status_column}2="Да"'], fill=REPORT_GREEN_FILL))
+            self.sheet.conditional_formatting.add(cell_range, FormulaRule(formula=[f'${status_column}2="Нет"'], fill=REPORT_RED_FILL))
+        self.sheet.append([])
+        self.sheet.append([])
+        self.sheet.append(header_cells(self.sheet, summary_df.columns))
+        for row in frame_rows(summary_df):
+            self.sheet.append(row)
+        self.workbook.save(self.report_path)
+
+@metrics.timed('report_streaming')
+def process_report_streaming(choice):
+    with excel_snapshot() as snapshot:
+        return write_streaming_report(choice, snapshot)
+
+def write_streaming_report(choice, snapshot):
+    df_releases = filter_configurations(load_release_frame(snapshot), choice)
+    releases_dict = dict(zip(df_releases['Конфигурации'], df_releases['Версия']))
+    ensure_release_history_loaded()
+    for name, version in releases_dict.items():
+        if isinstance(version, str):
+            version_index.add_release(name, version)
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = 'csv' if REPORT_STREAM_FORMAT == 'csv' else 'xlsx'
+    report_path = f"{REPORT_FOLDER}report_{choice}_{timestamp}.{extension}"
+    writer = StreamingReportWriter(report_path, ['Клиент', 'Программный продукт', 'Новый', 'Актуальный', 'Отстает (релизов)'])
+    status_counts = {'Да': 0, 'Нет': 0}
+    product_counts = pd.Series(dtype='int64')
+    behind_cache = {}
+    for chunk in iter_update_chunks(excel_file=snapshot):
+        with metrics.timer('report_classify'):
+            df_chunk = classify_updates(chunk, releases_dict)
+            df_chunk['Отстает (релизов)'] = releases_behind_column(df_chunk, behind_cache)
+            for status, count in df_chunk['Актуальный'].value_counts().items():
+                status_counts[status] = status_counts.get(status, 0) + int(count)
+            actual = df_chunk[df_chunk['Актуальный'] == 'Да'].groupby('Программный продукт').size()
+            product_counts = product_counts.add(actual, fill_value=0)
+        with metrics.timer('report_write'):
+            writer.write(df_chunk)
+        metrics.inc('report_rows', len(df_chunk))
+
+    with metrics.timer('report_write'):
+        writer.close(summary_from_counts(df_releases, product_counts, releases_dict))
+
+    print(f"\nОтчет сохранен: {report_path}")
+    print(f"Всего записей: {writer.rows}")
+    print(f"Актуальные: {status_counts.get('Да', 0)}")
+    print(f"Устаревшие: {status_counts.get('Нет', 0)}")
+    return report_path
+
+@metrics.timed('report_total')
+def process_report(choice=None):
     if choice is None:
         print("\nВыберите тип конфигурации:")
         print("1 - Бюджетные учреждения")
@@ -451,75 +2614,688 @@ def process_report(choice=None):
         print("3 - Все конфигурации")
         choice = input("Ваш выбор (1/2/3): ").strip()
 
+    if REPORT_STREAMING_ROWS is not None and update_list_size(REPORT_STREAMING_ROWS) > REPORT_STREAMING_ROWS:
+        return process_report_streaming(choice)
+
+    df_releases, df_updates = load_data()
     df_releases = filter_configurations(df_releases, choice)
     releases_dict = dict(zip(df_releases['Конфигурации'], df_releases['Версия']))
 
-    def check_version(row):
-        product = row['Программный продукт']
-        version = row['Новый']
-        if product in releases_dict:
-            return 'Да' if version == releases_dict[product] else 'Нет'
-        return None
+    ensure_release_history_loaded()
+    with metrics.timer('report_classify'):
+        df_report = classify_updates(df_updates, releases_dict)
+        for name, version in releases_dict.items():
+            if isinstance(version, str):
+                version_index.add_release(name, version)
+        df_report['Отстает (релизов)'] = releases_behind_column(df_report)
+        summary_df = build_summary(df_releases, df_report, releases_dict)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_path = f"{REPORT_FOLDER}report_{choice}_{timestamp}.xlsx"
 
-    df_updates['Актуальный'] = df_updates.apply(check_version, axis=1)
-    df_report = df_updates.dropna(subset=['Актуальный'])[['Клиент', 'Программный продукт', 'Новый', 'Актуальный']]
+    write_report(report_path, df_report, summary_df)
 
-    summary_data = []
-    exclude = ["Конфигурации хозрасчетных организаций", "Платформа 1С", "Конфигурации бюджетных учреждений"]
+    print(f"\nОтчет сохранен: {report_path}")
+    status_counts = df_report['Актуальный'].value_counts()
+    print(f"Всего записей: {len(df_report)}")
+    print(f"Актуальные: {status_counts.get('Да', 0)}")
+    print(f"Устаревшие: {status_counts.get('Нет', 0)}")
+    return report_path
 
-    for config in df_releases['Конфигурации'].unique():
-        if config not in exclude:
-            current_ver = releases_dict.get(config, 'Неизвестно')
-            count = df_report[(df_report['Программный продукт'] == config) & (df_report['Актуальный'] == 'Да')].shape[0]
-            summary_data.append([config, current_ver, count])
+def report_source_fingerprint():
+    if STORAGE_BACKEND == 'sqlite':
+        digest = hashlib.sha1()
+        with db_connection() as connection:
+            for row in connection.execute("SELECT name, version, calc_type FROM releases ORDER BY name"):
+                digest.update(repr(row).encode('utf-8'))
+            digest.update(repr(connection.execute("SELECT count(*), max(id) FROM updates").fetchone()).encode('utf-8'))
+            digest.update(repr(connection.execute("SELECT version FROM data_versions WHERE name = 'updates'").fetchone()).encode('utf-8'))
+            digest.update(repr(connection.execute("SELECT count(*), max(id) FROM release_history").fetchone()).encode('utf-8'))
+        return digest.hexdigest()
+    stat = os.stat(EXCEL_FILE_PATH)
+    fingerprint = f"{stat.st_mtime_ns}:{stat.st_size}"
+    if os.path.exists(RELEASE_HISTORY_FILE):
+        history_stat = os.stat(RELEASE_HISTORY_FILE)
+        fingerprint += f":{history_stat.st_mtime_ns}:{history_stat.st_size}"
+    return fingerprint
+
+def load_report_cache():
+    if os.path.exists(REPORT_CACHE_FILE):
+        try:
+            with open(REPORT_CACHE_FILE, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print("Ошибка при загрузке кэша отчетов:", e)
+    return {}
 
-    summary_df = pd.DataFrame(summary_data, columns=['Конфигурация', 'Актуальная версия', 'Обновлено'])
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-    report_path = f"{REPORT_FOLDER}report_{timestamp}.xlsx"
+def save_report_cache(cache):
+    try:
+        tmp_path = REPORT_CACHE_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, REPORT_CACHE_FILE)
+    except Exception as e:
+        print("Ошибка при сохранении кэша отчетов:", e)
+
+def evict_report_cache(cache):
+    now = time.time()
+    kept = {}
+    total_size = 0
+    for key, entry in sorted(cache.items(), key=lambda item: item[1]['created'], reverse=True):
+        if not os.path.exists(entry['path']):
+            continue
+        size = os.path.getsize(entry['path'])
+        # самый свежий отчет оставляем всегда, даже если он один больше лимита
+        if now - entry['created'] > REPORT_CACHE_MAX_AGE or (kept and total_size + size > REPORT_CACHE_MAX_BYTES):
+            try:
+                remove_report_files(entry['path'])
+            except Exception as e:
+                print(f"Не удалось удалить устаревший отчет {entry['path']}: {e}")
+            continue
+        total_size += size
+        kept[key] = entry
+    return kept
+
+def remove_report_files(report_path):
+    base, extension = os.path.splitext(report_path)
+    for path in [report_path, report_path + '.zip'] + glob.glob(f"{glob.escape(base)}_part*{extension}*"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def get_report(choice):
+    key = f"{choice}:{report_source_fingerprint()}"
+    with report_cache_lock:
+        entry = load_report_cache().get(key)
+    if entry and os.path.exists(entry['path']) and time.time() - entry['created'] <= REPORT_CACHE_MAX_AGE:
+        print(f"Отчет взят из кэша: {entry['path']}")
+        return entry['path']
+
+    report_path = process_report(choice)
+    with report_cache_lock:
+        cache = load_report_cache()
+        cache[key] = {'path': report_path, 'created': time.time()}
+        save_report_cache(evict_report_cache(cache))
+    return report_path
 
-    with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
-        df_report.to_excel(writer, sheet_name='Отчет', index=False)
-        sheet = writer.sheets['Отчет']
+def is_blank_row(row):
+    return not any(value not in (None, '') for value in row)
 
-        red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-        green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+def iter_report_file(report_path):
+    if report_path.endswith('.csv'):
+        with open(report_path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.reader(f, delimiter=';'):
+                yield tuple(row)
+        return
+    workbook = openpyxl.load_workbook(report_path, read_only=True)
+    try:
+        sheet = workbook['Отчет']
+        sheet.reset_dimensions()
+        yield from sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def iter_report_rows(report_path):
+    # строки отчета идут до первой пустой строки, за ними - сводка
+    rows = iter_report_file(report_path)
+    next(rows, None)
+    for row in rows:
+        if is_blank_row(row):
+            return
+        yield row
+
+def scan_report(report_path):
+    rows = iter_report_file(report_path)
+    header = list(next(rows))
+    product_col, client_col = header.index('Программный продукт'), header.index('Клиент')
+    counts = {}
+    for row in rows:
+        if is_blank_row(row):
+            break
+        key = (row[product_col], row[client_col])
+        counts[key] = counts.get(key, 0) + 1
+    summary = [row for row in rows if not is_blank_row(row)]
+    return header, counts, summary[:1], summary[1:]
+
+def plan_report_parts(counts, parts):
+    # конфигурация целиком попадает в одну часть; слишком большая делится по клиентам
+    product_counts = {}
+    for (product, _), count in counts.items():
+        product_counts[product] = product_counts.get(product, 0) + count
+    part_rows = math.ceil(sum(product_counts.values()) / parts)
+    keys = []
+    for product, count in product_counts.items():
+        if count <= part_rows:
+            keys.append((count, product))
+    keys.extend((count, key) for key, count in counts.items() if product_counts[key[0]] > part_rows)
+
+    loads = [(0, part) for part in range(parts)]
+    assignment = {}
+    for count, key in sorted(keys, key=lambda item: item[0], reverse=True):
+        load, part = heapq.heappop(loads)
+        assignment[key] = part
+        heapq.heappush(loads, (load + count, part))
+    return assignment
+
+def split_report(report_path, parts):
+    header, counts, summary_header, summary_rows = scan_report(report_path)
+    assignment = plan_report_parts(counts, parts)
+    base, extension = os.path.splitext(report_path)
+    paths = [f"{base}_part{part + 1}of{parts}{extension}" for part in range(parts)]
+    writers = [StreamingReportWriter(path, header) for path in paths]
+    products = [set() for _ in range(parts)]
+    product_col, client_col = header.index('Программный продукт'), header.index('Клиент')
+    for row in iter_report_rows(report_path):
+        product = row[product_col]
+        part = assignment.get(product)
+        if part is None:
+            part = assignment[(product, row[client_col])]
+        writers[part].write_rows([list(row)])
+        products[part].add(product)
+
+    summary_columns = list(summary_header[0]) if summary_header else ['Конфигурация', 'Актуальная версия', 'Обновлено']
+    for writer, part_products in zip(writers, products):
+        part_summary = [row for row in summary_rows if row[0] in part_products]
+        writer.close(pd.DataFrame(part_summary, columns=summary_columns))
+    return [(path, writer.rows) for path, writer in zip(paths, writers) if writer.rows]
+
+def compress_report(report_path):
+    # xlsx уже является zip-архивом, повторное сжатие почти ничего не дает
+    if report_path.endswith('.xlsx') or os.path.getsize(report_path) < REPORT_COMPRESS_MIN_BYTES:
+        return report_path
+    zip_path = report_path + '.zip'
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+        archive.write(report_path, arcname=os.path.basename(report_path))
+    return zip_path
+
+@metrics.timed('report_prepare')
+def prepare_report_delivery(report_path, limit=None):
+    limit = limit or TELEGRAM_DOCUMENT_LIMIT
+    stat = os.stat(report_path)
+    key = (report_path, stat.st_mtime_ns, stat.st_size, limit)
+    with delivery_lock:
+        report_lock = delivery_locks.setdefault(report_path, Lock())
+    # сжатие и деление идут под блокировкой своего отчета: отправки других отчетов и file_id их не ждут
+    with report_lock:
+        with delivery_lock:
+            files = delivery_cache.get(key)
+        if files and all(os.path.exists(path) for path in files):
+            return files
+
+        delivered = compress_report(report_path)
+        files = [delivered]
+        if os.path.getsize(delivered) > limit:
+            # частей с запасом, чтобы неравномерные по размеру строки не вывели часть за предел
+            parts = math.ceil(os.path.getsize(delivered) / (limit * 0.8))
+            while True:
+                if parts > REPORT_MAX_PARTS:
+                    raise ValueError(f"Отчет {report_path} не помещается в {REPORT_MAX_PARTS} частей по {limit // (1024 * 1024)} МБ")
+                files = []
+                for path, _ in split_report(report_path, parts):
+                    files.append(compress_report(path))
+                    if files[-1] != path:
+                        os.remove(path)
+                if all(os.path.getsize(path) <= limit for path in files):
+                    break
+                for path in files:
+                    os.remove(path)
+                parts *= 2
+            print(f"Отчет {os.path.basename(report_path)} разделен на части: {len(files)}.")
+        with delivery_lock:
+            delivery_cache[key] = files
+        return files
+
+def document_key(path):
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+def load_file_ids():
+    if os.path.exists(TELEGRAM_FILE_IDS_FILE):
+        try:
+            with open(TELEGRAM_FILE_IDS_FILE, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print("Ошибка при загрузке file_id документов:", e)
+    return {}
 
-        for row in sheet.iter_rows(min_row=2, max_row=len(df_report)+1):
-            status = row[3].value
-            fill_color = green_fill if status == 'Да' else red_fill if status == 'Нет' else None
-            if fill_color:
-                for cell in row:
-                    cell.fill = fill_color
+def save_file_ids(file_ids):
+    # записи для удаленных отчетов больше не понадобятся
+    kept = {key: file_id for key, file_id in file_ids.items() if os.path.exists(key.rsplit(':', 2)[0])}
+    try:
+        tmp_path = TELEGRAM_FILE_IDS_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(kept, f)
+        os.replace(tmp_path, TELEGRAM_FILE_IDS_FILE)
+    except Exception as e:
+        print("Ошибка при сохранении file_id документов:", e)
 
-        summary_start = len(df_report) + 3
-        summary_df.to_excel(writer, sheet_name='Отчет', startrow=summary_start, index=False)
+def send_document(bot, chat_id, path, caption=None):
+    key = document_key(path)
+    with file_ids_lock:
+        file_id = load_file_ids().get(key)
 
-    print(f"\nОтчет сохранен: {report_path}")
-    print(f"Всего записей: {len(df_report)}")
-    print(f"Актуальные: {df_report['Актуальный'].value_counts().get('Да', 0)}")
-    print(f"Устаревшие: {df_report['Актуальный'].value_counts().get('Нет', 0)}")
-    return report_path
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        try:
+            if file_id:
+                try:
+                    with metrics.timer('telegram_send'):
+                        bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+                    metrics.inc('telegram_file_id_reused')
+                    return
+                except BadRequest as e:
+                    print(f"file_id для {os.path.basename(path)} не принят, файл будет загружен заново: {e}")
+                    file_id = None
+            with open(path, 'rb') as f, metrics.timer('telegram_upload'):
+                message = bot.send_document(
+                    chat_id=chat_id, document=f, filename=os.path.basename(path),
+                    caption=caption, timeout=REPORT_UPLOAD_TIMEOUT
+                )
+            break
+        except RetryAfter as e:
+            metrics.inc('telegram_retry_after')
+            time.sleep(e.retry_after)
+        except (TimedOut, NetworkError):
+            if attempt == BROADCAST_MAX_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+    else:
+        raise RuntimeError(f"Не удалось загрузить {os.path.basename(path)}: превышен лимит повторов")
+    metrics.inc('telegram_uploaded_bytes', os.path.getsize(path))
+
+    document = getattr(message, 'document', None)
+    if document is not None and getattr(document, 'file_id', None):
+        with file_ids_lock:
+            file_ids = load_file_ids()
+            file_ids[key] = document.file_id
+            save_file_ids(file_ids)
+
+@metrics.timed('report_delivery')
+def deliver_report(bot, chat_id, report_path):
+    files = prepare_report_delivery(report_path)
+    for number, path in enumerate(files, start=1):
+        caption = f"Часть {number} из {len(files)}" if len(files) > 1 else None
+        send_document(bot, chat_id, path, caption=caption)
+    return len(files)
+
+class JobQueue:
+    # одинаковые задачи, поставленные пока первая еще выполняется, ждут ее результата, а не запускаются заново
+    def __init__(self, workers, limits):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.limits = limits
+        self.lock = Lock()
+        self.in_flight = {}
+        self.running = {}
+        self.pending = {}
+
+    def submit(self, kind, key, func, callback):
+        job_key = (kind, key)
+        with self.lock:
+            job = self.in_flight.get(job_key)
+            if job is not None:
+                job['callbacks'].append(callback)
+                return False
+            job = {'key': job_key, 'func': func, 'callbacks': [callback]}
+            self.in_flight[job_key] = job
+            if self.running.get(kind, 0) < self.limits.get(kind, JOB_WORKERS):
+                self.running[kind] = self.running.get(kind, 0) + 1
+                self.executor.submit(self.run, job)
+            else:
+                self.pending.setdefault(kind, deque()).append(job)
+        return True
 
-def check_updates_loop():
-    while True:
-        print(f"\n[{datetime.datetime.now()}] Запуск проверки обновлений...")
+    def run(self, job):
+        kind = job['key'][0]
+        result, error = None, None
         try:
-            updates = check_updates()
-            email_updates = check_email_updates()
+            result = job['func']()
+        except Exception as e:
+            error = e
+            print(f"Ошибка при выполнении задачи {job['key']}: {e}")
+
+        with self.lock:
+            self.in_flight.pop(job['key'], None)
+            callbacks = list(job['callbacks'])
+            queue = self.pending.get(kind)
+            if queue:
+                self.executor.submit(self.run, queue.popleft())
+            else:
+                self.running[kind] -= 1
 
-            if updates and telegram_bot:
-                message = "Обновления по 1С:\n" + "\n".join(updates)
-                for chat_id in SUBSCRIBED_USERS:
-                    try:
-                        telegram_bot.send_message(chat_id=chat_id, text=message)
-                    except Exception as e:
-                        print(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+        for callback in callbacks:
+            try:
+                callback(result, error)
+            except Exception as e:
+                print(f"Ошибка при отправке результата задачи {job['key']}: {e}")
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+job_queue = JobQueue(JOB_WORKERS, JOB_LIMITS)
+
+def split_message(text, limit=None):
+    limit = limit or TELEGRAM_MESSAGE_LIMIT
+    parts = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        parts.append(current)
+    return parts
+
+def drop_subscribers(dropped):
+    removed = [chat_id for chat_id in dropped if chat_id in SUBSCRIBED_USERS]
+    if not removed:
+        return
+    SUBSCRIBED_USERS.difference_update(removed)
+    save_subscribers()
+    for chat_id in removed:
+        print(f"Пользователь {chat_id} удален из подписчиков: {dropped[chat_id]}")
+
+def send_to_chat(bot, chat_id, parts, dropped):
+    for text in parts:
+        for attempt in range(BROADCAST_MAX_RETRIES + 1):
+            broadcast_limiter.wait('global')
+            chat_limiter.wait(chat_id)
+            try:
+                with metrics.timer('telegram_send'):
+                    bot.send_message(chat_id=chat_id, text=text)
+                metrics.inc('telegram_sent')
+                break
+            except RetryAfter as e:
+                metrics.inc('telegram_retry_after')
+                # лимит Telegram: притормаживаем и этот чат, и всю рассылку
+                broadcast_limiter.defer('global', e.retry_after)
+                chat_limiter.defer(chat_id, e.retry_after)
+            except Unauthorized as e:
+                dropped[chat_id] = e
+                return False
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    dropped[chat_id] = e
+                else:
+                    print(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+                return False
+            except (TimedOut, NetworkError) as e:
+                if attempt == BROADCAST_MAX_RETRIES:
+                    print(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+                    return False
+                time.sleep(2 ** attempt)
+        else:
+            print(f"Не удалось отправить уведомление пользователю {chat_id}: превышен лимит повторов.")
+            return False
+    return True
+
+@metrics.timed('broadcast')
+def broadcast(text, chat_ids=None, bot=None):
+    bot = bot or telegram_bot
+    if not bot:
+        return 0
+    chat_ids = list(SUBSCRIBED_USERS if chat_ids is None else chat_ids)
+    parts = split_message(text)
+    # недоступные чаты собираются здесь и удаляются одной записью файла после рассылки
+    dropped = {}
+    futures = [broadcast_executor.submit(send_to_chat, bot, chat_id, parts, dropped) for chat_id in chat_ids]
+    delivered = sum(1 for future in futures if future.result())
+    drop_subscribers(dropped)
+    metrics.inc('telegram_undelivered', len(chat_ids) - delivered)
+    print(f"Уведомление доставлено {delivered} из {len(chat_ids)} подписчиков.")
+    return delivered
+
+def notify_release_updates(updates):
+    if updates:
+        broadcast("Обновления по 1С:\n" + "\n".join(updates))
+
+broadcast_limiter = RateLimiter(BROADCAST_GLOBAL_RATE)
+chat_limiter = RateLimiter(BROADCAST_CHAT_RATE)
+broadcast_executor = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix="broadcast")
+
+def run_stage(name, func, on_done=None):
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        result = func()
+        status = 'ok'
+        if on_done:
+            on_done(result)
+        return result
+    finally:
+        metrics.observe(f"stage_{name}", time.perf_counter() - started)
+        metrics.inc(f"stage_{name}_{status}")
+        with stage_lock:
+            running_stages.discard(name)
+            STAGE_TIMINGS[name] = {
+                'seconds': time.perf_counter() - started,
+                'status': status,
+                'finished': datetime.datetime.now()
+            }
+
+def run_check_cycle(stage_names=('portal', 'mail'), notify=True):
+    # этапы независимы: зависание IMAP не задерживает уведомление о релизах и наоборот
+    stages = {
+        'portal': (check_updates, notify_release_updates if notify else None, PORTAL_STAGE_TIMEOUT),
+        'mail': (check_email_updates, None, MAIL_STAGE_TIMEOUT),
+        'mail_export': (export_mail_log, None, MAIL_STAGE_TIMEOUT)
+    }
+    stages = {name: stage for name, stage in stages.items() if name in stage_names}
+    started = time.monotonic()
+    futures = {}
+    results = {}
+    for name, (func, on_done, timeout) in stages.items():
+        with stage_lock:
+            if name in running_stages:
+                print(f"Этап '{name}' еще не завершился с прошлого запуска, пропускаем.")
+                results[name] = (None, Exception("предыдущий запуск этапа еще выполняется"))
+                continue
+            running_stages.add(name)
+        futures[name] = stage_executor.submit(run_stage, name, func, on_done)
 
+    for name, future in futures.items():
+        timeout = stages[name][2]
+        try:
+            results[name] = (future.result(timeout=max(0, started + timeout - time.monotonic())), None)
+        except FutureTimeout:
+            print(f"Этап '{name}' не уложился в {timeout} секунд.")
+            metrics.inc(f"stage_{name}_timeout")
+            with stage_lock:
+                STAGE_TIMINGS[name] = {'seconds': timeout, 'status': 'timeout', 'finished': datetime.datetime.now()}
+            results[name] = (None, Exception(f"превышено время ожидания ({timeout} с)"))
+        except Exception as e:
+            print(f"Ошибка на этапе '{name}': {e}")
+            results[name] = (None, e)
+
+    with stage_lock:
+        timings = ", ".join(f"{name}: {data['seconds']:.1f} с ({data['status']})" for name, data in STAGE_TIMINGS.items() if name in stages)
+    print(f"Время этапов: {timings}")
+    return results
+
+def parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"недопустимое значение поля '{field}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+def cron_next(expression, after):
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError("ожидается 5 полей: минута час день месяц день_недели")
+    minutes = parse_cron_field(fields[0], 0, 59)
+    hours = parse_cron_field(fields[1], 0, 23)
+    days = parse_cron_field(fields[2], 1, 31)
+    months = parse_cron_field(fields[3], 1, 12)
+    weekdays = {day % 7 for day in parse_cron_field(fields[4], 0, 7)}
+    any_day, any_weekday = fields[2] == '*', fields[4] == '*'
+
+    moment = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    limit = moment + datetime.timedelta(days=366 * 5)
+    while moment < limit:
+        if moment.month not in months:
+            moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            continue
+        day_match = moment.day in days
+        weekday_match = (moment.weekday() + 1) % 7 in weekdays
+        # как в cron: если заданы и день месяца, и день недели, достаточно совпадения любого
+        if any_day and any_weekday:
+            matched = True
+        elif any_day:
+            matched = weekday_match
+        elif any_weekday:
+            matched = day_match
+        else:
+            matched = day_match or weekday_match
+        if not matched:
+            moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            continue
+        if moment.hour not in hours:
+            moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            continue
+        if moment.minute not in minutes:
+            moment += datetime.timedelta(minutes=1)
+            continue
+        return moment
+    raise ValueError("расписание никогда не срабатывает")
+
+class Scheduler:
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.lock = Lock()
+        self.wake = Event()
+        self.state = self.load()
+
+    def load(self):
+        data = {}
+        if os.path.exists(SCHEDULE_FILE):
+            try:
+                with open(SCHEDULE_FILE, "r") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print("Ошибка при загрузке расписания:", e)
+        state = {}
+        for name in self.tasks:
+            entry = data.get(name, {})
+            state[name] = {
+                'interval': entry.get('interval', UPDATE_INTERVAL),
+                'cron': entry.get('cron'),
+                'last_run': entry.get('last_run'),
+                'next_run': entry.get('next_run') or time.time(),
+                'failures': entry.get('failures', 0)
+            }
+        return state
+
+    def save(self):
+        try:
+            tmp_path = SCHEDULE_FILE + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, SCHEDULE_FILE)
         except Exception as e:
-            print(f"Ошибка при проверке обновлений: {str(e)}")
+            print("Ошибка при сохранении расписания:", e)
+
+    def next_time(self, entry, now):
+        if entry['cron']:
+            moment = cron_next(entry['cron'], datetime.datetime.fromtimestamp(now))
+            return moment.timestamp() + random.uniform(0, SCHEDULE_JITTER)
+        base = entry['last_run'] if entry['last_run'] else now
+        return max(now, base + entry['interval']) + random.uniform(0, min(SCHEDULE_JITTER, entry['interval'] * 0.1))
+
+    def set_interval(self, names, seconds):
+        with self.lock:
+            now = time.time()
+            for name in names:
+                entry = self.state[name]
+                entry['interval'] = seconds
+                entry['cron'] = None
+                entry['next_run'] = self.next_time(entry, now)
+            self.save()
+        self.wake.set()
+
+    def set_cron(self, name, expression):
+        cron_next(expression, datetime.datetime.now())
+        with self.lock:
+            entry = self.state[name]
+            entry['cron'] = expression
+            entry['next_run'] = self.next_time(entry, time.time())
+            self.save()
+        self.wake.set()
+
+    def reset(self, names):
+        with self.lock:
+            now = time.time()
+            for name in names:
+                entry = self.state[name]
+                entry['last_run'] = now
+                entry['failures'] = 0
+                entry['next_run'] = self.next_time(entry, now)
+            self.save()
+        self.wake.set()
+
+    def describe(self):
+        with self.lock:
+            lines = []
+            for name, entry in self.state.items():
+                rule = f"cron '{entry['cron']}'" if entry['cron'] else f"каждые {entry['interval']} с"
+                next_run = datetime.datetime.fromtimestamp(entry['next_run']).strftime("%Y-%m-%d %H:%M:%S")
+                lines.append(f"{name}: {rule}, следующий запуск {next_run}")
+            return "\n".join(lines)
+
+    def run(self):
+        while True:
+            self.wake.clear()
+            with self.lock:
+                now = time.time()
+                due = [name for name in self.tasks if self.state[name]['next_run'] <= now]
+                wait = min(self.state[name]['next_run'] for name in self.tasks) - now
+            if not due:
+                # ожидание прерывается сразу при смене интервала или ручной проверке
+                self.wake.wait(timeout=min(max(wait, 0), 3600))
+                continue
 
-        print(f"Ожидаем {UPDATE_INTERVAL} секунд до следующей проверки...\n")
-        time.sleep(UPDATE_INTERVAL)
+            print(f"\n[{datetime.datetime.now()}] Запуск проверки обновлений: {', '.join(due)}...")
+            try:
+                results = run_check_cycle(due)
+            except Exception as e:
+                print(f"Ошибка при проверке обновлений: {str(e)}")
+                results = {name: (None, e) for name in due}
+
+            with self.lock:
+                now = time.time()
+                for name in due:
+                    entry = self.state[name]
+                    entry['last_run'] = now
+                    if results.get(name, (None, None))[1]:
+                        entry['failures'] += 1
+                        delay = min(SCHEDULE_BACKOFF_BASE * 2 ** (entry['failures'] - 1), SCHEDULE_BACKOFF_MAX)
+                        entry['next_run'] = min(now + delay, self.next_time(entry, now))
+                    else:
+                        entry['failures'] = 0
+                        entry['next_run'] = self.next_time(entry, now)
+                self.save()
+            print(self.describe())
+
+scheduler = Scheduler(['portal', 'mail'] + (['mail_export'] if STORAGE_BACKEND != 'sqlite' else []))
+
+def check_updates_loop():
+    scheduler.run()
 
 def start(update: Update, context: CallbackContext):
     update.message.reply_text(
@@ -533,6 +3309,11 @@ def start(update: Update, context: CallbackContext):
         "/unsubscribe - отписаться от уведомлений\n"
         "/check - ручная проверка обновлений\n"
         "/setinterval - изменить интервал проверки обновлений\n"
+        "/setcron - задать расписание проверки в формате cron\n"
+        "/schedule - расписание проверок\n"
+        "/export - выгрузить данные в Excel\n"
+        "/stats - время этапов (p50/p95)\n"
+        "/behind - клиенты, отстающие на несколько релизов\n"
         "/help - список команд"
     )
 
@@ -580,14 +3361,25 @@ def report_callback(update: Update, context: CallbackContext):
     query.answer()
     data = query.data
     choice = data.split(":")[1]
-    query.edit_message_text(text=f"Генерируется отчёт для выбранного типа конфигурации...")
-    try:
-        report_path = process_report(choice)
-        with open(report_path, 'rb') as f:
-            context.bot.send_document(chat_id=query.message.chat_id, document=f, filename=os.path.basename(report_path))
-        context.bot.send_message(chat_id=query.message.chat_id, text="Отчёт отправлен.")
-    except Exception as e:
-        context.bot.send_message(chat_id=query.message.chat_id, text=f"Ошибка при создании отчёта: {str(e)}")
+    chat_id = query.message.chat_id
+    bot = context.bot
+
+    def deliver(report_path, error):
+        if error:
+            bot.send_message(chat_id=chat_id, text=f"Ошибка при создании отчёта: {str(error)}")
+            return
+        try:
+            parts = deliver_report(bot, chat_id, report_path)
+        except Exception as e:
+            print(f"Ошибка при отправке отчёта {report_path} в чат {chat_id}: {e}")
+            bot.send_message(chat_id=chat_id, text=f"Ошибка при отправке отчёта: {str(e)}")
+            return
+        bot.send_message(chat_id=chat_id, text="Отчёт отправлен." if parts == 1 else f"Отчёт отправлен частями: {parts}.")
+
+    if job_queue.submit('report', choice, lambda: get_report(choice), deliver):
+        query.edit_message_text(text=f"Генерируется отчёт для выбранного типа конфигурации...")
+    else:
+        query.edit_message_text(text=f"Такой отчёт уже формируется, он будет отправлен по готовности.")
 
 def subscribe_command(update: Update, context: CallbackContext):
     if update.effective_chat.id not in AUTHENTICATED_USERS:
@@ -615,35 +3407,56 @@ def help_command(update: Update, context: CallbackContext):
         "/unsubscribe - отписаться от уведомлений\n"
         "/check - ручная проверка обновлений\n"
         "/setinterval - изменить интервал проверки обновлений\n"
+        "/setcron - задать расписание проверки в формате cron\n"
+        "/schedule - расписание проверок\n"
+        "/export - выгрузить данные в Excel\n"
+        "/stats - время этапов (p50/p95)\n"
+        "/behind - клиенты, отстающие на несколько релизов\n"
         "/help - помощь"
     )
 
+def run_manual_check():
+    results = run_check_cycle(notify=False)
+    updates, updates_error = results['portal']
+    email_updates, email_error = results['mail']
+    # ручная проверка сдвигает плановую, чтобы не проверять дважды подряд
+    scheduler.reset([name for name, (result, error) in results.items() if not error])
+
+    msg_parts = []
+    if updates_error:
+        msg_parts.append(f"Ошибка при проверке портала 1С: {str(updates_error)}")
+    elif updates:
+        msg_parts.append("Обновления по 1С:\n" + "\n".join(updates))
+    else:
+        msg_parts.append("Обновлений 1С нет.")
+
+    if email_error:
+        msg_parts.append(f"Ошибка при проверке почты: {str(email_error)}")
+    elif email_updates:
+        msg_parts.append(f"Обработано новых писем: {len(email_updates)}. Смотрите лист 'MailUpdates'.")
+    else:
+        msg_parts.append("Новых писем (подходящих под критерии) нет.")
+
+    return "\n\n".join(msg_parts)
+
 def manual_update_command(update: Update, context: CallbackContext):
     if update.effective_chat.id not in AUTHENTICATED_USERS:
         update.message.reply_text("Сначала авторизуйтесь командой /login.")
         return
 
-    update.message.reply_text("Запуск ручной проверки обновлений...")
-
-    try:
-        updates = check_updates()
-        email_updates = check_email_updates()
-
-        msg_parts = []
-        if updates:
-            msg_parts.append("Обновления по 1С:\n" + "\n".join(updates))
-        else:
-            msg_parts.append("Обновлений 1С нет.")
+    chat_id = update.effective_chat.id
+    bot = context.bot
 
-        if email_updates:
-            msg_parts.append(f"Обработано новых писем: {len(email_updates)}. Смотрите лист 'MailUpdates'.")
+    def deliver(text, error):
+        if error:
+            bot.send_message(chat_id=chat_id, text=f"Ошибка при проверке обновлений: {str(error)}")
         else:
-            msg_parts.append("Новых писем (подходящих под критерии) нет.")
+            bot.send_message(chat_id=chat_id, text=text)
 
-        update.message.reply_text("\n\n".join(msg_parts))
-
-    except Exception as e:
-        update.message.reply_text(f"Ошибка при проверке обновлений: {str(e)}")
+    if job_queue.submit('check', 'check', run_manual_check, deliver):
+        update.message.reply_text("Запуск ручной проверки обновлений...")
+    else:
+        update.message.reply_text("Проверка уже выполняется, результат придёт по её завершении.")
 
 def set_interval_command(update: Update, context: CallbackContext):
     if update.effective_chat.id not in AUTHENTICATED_USERS:
@@ -651,19 +3464,114 @@ def set_interval_command(update: Update, context: CallbackContext):
         return
     args = context.args
     if not args:
-        update.message.reply_text("Использование: /setinterval <секунд>")
+        update.message.reply_text(f"Использование: /setinterval [{'|'.join(scheduler.tasks)}] <секунд>")
         return
+    names = scheduler.tasks
+    if args[0] in scheduler.tasks:
+        names = [args[0]]
+        args = args[1:]
     try:
         global UPDATE_INTERVAL
         new_interval = int(args[0])
-        UPDATE_INTERVAL = new_interval
-        update.message.reply_text(f"Интервал проверки обновлений изменен на {new_interval} секунд.")
-    except ValueError:
+        if new_interval <= 0:
+            raise ValueError
+        if names == scheduler.tasks:
+            UPDATE_INTERVAL = new_interval
+        scheduler.set_interval(names, new_interval)
+        update.message.reply_text(f"Интервал проверки обновлений изменен на {new_interval} секунд.\n{scheduler.describe()}")
+    except (ValueError, IndexError):
         update.message.reply_text("Пожалуйста, введите корректное число секунд.")
 
+def set_cron_command(update: Update, context: CallbackContext):
+    if update.effective_chat.id not in AUTHENTICATED_USERS:
+        update.message.reply_text("Сначала авторизуйтесь командой /login.")
+        return
+    args = context.args
+    if len(args) != 6 or args[0] not in scheduler.tasks:
+        update.message.reply_text(f"Использование: /setcron <{'|'.join(scheduler.tasks)}> <минута> <час> <день> <месяц> <день_недели>")
+        return
+    try:
+        scheduler.set_cron(args[0], " ".join(args[1:]))
+        update.message.reply_text(f"Расписание изменено.\n{scheduler.describe()}")
+    except ValueError as e:
+        update.message.reply_text(f"Некорректное расписание: {e}")
+
+def schedule_command(update: Update, context: CallbackContext):
+    if update.effective_chat.id not in AUTHENTICATED_USERS:
+        update.message.reply_text("Сначала авторизуйтесь командой /login.")
+        return
+    update.message.reply_text(scheduler.describe())
+
+def format_behind(n):
+    found = refresh_staleness_index().behind(n)
+    if not found:
+        return f"Клиентов, отстающих более чем на {n} релиз(ов), нет."
+    lines = [f"Отстают более чем на {n} релиз(ов): {len(found)}"]
+    lines.extend(f"• {client} — {product}: {count}" for client, product, count in found)
+    return "\n".join(lines)
+
+def behind_command(update: Update, context: CallbackContext):
+    if update.effective_chat.id not in AUTHENTICATED_USERS:
+        update.message.reply_text("Сначала авторизуйтесь командой /login.")
+        return
+    try:
+        n = int(context.args[0]) if context.args else STALE_RELEASES_THRESHOLD
+    except ValueError:
+        update.message.reply_text("Использование: /behind [число релизов]")
+        return
+    chat_id = update.effective_chat.id
+    bot = context.bot
+
+    def deliver(text, error):
+        if error:
+            bot.send_message(chat_id=chat_id, text=f"Ошибка при поиске отстающих клиентов: {str(error)}")
+            return
+        for part in split_message(text):
+            bot.send_message(chat_id=chat_id, text=part)
+
+    job_queue.submit('report', f"behind:{n}", lambda: format_behind(n), deliver)
+
+def stats_command(update: Update, context: CallbackContext):
+    if update.effective_chat.id not in AUTHENTICATED_USERS:
+        update.message.reply_text("Сначала авторизуйтесь командой /login.")
+        return
+    for part in split_message(metrics.describe()):
+        update.message.reply_text(part)
+
+def export_command(update: Update, context: CallbackContext):
+    if update.effective_chat.id not in AUTHENTICATED_USERS:
+        update.message.reply_text("Сначала авторизуйтесь командой /login.")
+        return
+    chat_id = update.effective_chat.id
+    bot = context.bot
+
+    def deliver(export_path, error):
+        if error:
+            bot.send_message(chat_id=chat_id, text=f"Ошибка при экспорте: {str(error)}")
+            return
+        try:
+            send_document(bot, chat_id, export_path)
+        except Exception as e:
+            print(f"Ошибка при отправке выгрузки {export_path} в чат {chat_id}: {e}")
+            bot.send_message(chat_id=chat_id, text=f"Ошибка при отправке выгрузки: {str(e)}")
+
+    job_queue.submit('export', 'export', export_data, deliver)
+    update.message.reply_text("Выгрузка поставлена в очередь.")
+
 def main():
+    if FETCH_BACKEND != 'http':
+        # при HTTP-режиме Selenium нужен только как запасной путь, драйвер найдется при первом запуске браузера
+        try:
+            resolve_chromedriver()
+        except Exception as e:
+            print(f"Не удалось подготовить chromedriver, попытка повторится при запуске браузера: {e}")
+    if STORAGE_BACKEND == 'sqlite':
+        init_db()
+    start_metrics_export()
     update_thread = Thread(target=check_updates_loop, daemon=True)
     update_thread.start()
+    if MAIL_IDLE_ENABLED:
+        mail_listener.start()
     updater = Updater(BOT_TOKEN)
     dispatcher = updater.dispatcher
     dispatcher.add_handler(CommandHandler("start", start))
@@ -685,6 +3593,11 @@ def main():
     dispatcher.add_handler(CommandHandler("help", help_command))
     dispatcher.add_handler(CommandHandler("check", manual_update_command))
     dispatcher.add_handler(CommandHandler("setinterval", set_interval_command))
+    dispatcher.add_handler(CommandHandler("setcron", set_cron_command))
+    dispatcher.add_handler(CommandHandler("schedule", schedule_command))
+    dispatcher.add_handler(CommandHandler("export", export_command))
+    dispatcher.add_handler(CommandHandler("stats", stats_command))
+    dispatcher.add_handler(CommandHandler("behind", behind_command))
 
     updater.start_polling()
 
@@ -693,15 +3606,22 @@ def main():
     print("Telegram-бот запущен.")
 
     while True:
-        command = input("\nВведите команду:\n1 - Создать отчёт\n2 - Выход\n3 - Играть в змейку\n> ").strip()
+        command = input("\nВведите команду:\n1 - Создать отчёт\n2 - Выход\n3 - Играть в змейку\n4 - Экспорт данных в Excel\n5 - Импорт данных из Excel в базу\n> ").strip()
         if command == '1':
             process_report()
         elif command == '2':
             print("Завершение работы...")
             updater.stop()
+            mail_listener.stop()
+            job_queue.close()
+            browser_pool.close()
             break
         elif command == '3':
             snake_game()
+        elif command == '4':
+            export_data()
+        elif command == '5':
+            import_excel_to_db()
         else:
             print("Некорректный ввод")
 